@@ -2,16 +2,25 @@ import argparse
 from tqdm import tqdm
 import csv
 import datetime
-from gwas_db_connect import DBConnection
+import os.path
+import sys
 import smtplib
 from os.path import basename
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import curation_arguments
+import curation_db
+import curation_metrics
 
-def get_curation_queue_data(database_name):
+
+def get_curation_queue_data(database_name, metrics=None, archive_dir=None):
     '''
     Get Curation Queue data
+
+    If archive_dir is given, the rows are also added to the snapshot archive
+    there, see queue_snapshot_archive.py.
     '''
 
     # List of queries
@@ -77,120 +86,170 @@ def get_curation_queue_data(database_name):
                                 'INITIAL_SAMPLE_DESCRIPTION', 'REPLICATION_SAMPLE_DESCRIPTION']
 
 
-    TIMESTAMP = get_timestamp()
-    outfile = open("data_queue_"+TIMESTAMP+".csv", "w")
-    csvout = csv.writer(outfile)
+    if metrics is None:
+        metrics = curation_metrics.RunMetrics('curation_queue')
+
+    with metrics.phase('connect'):
+        db_pool = curation_db.get_pool(database_name)
+        connection = db_pool.acquire()
+    cursor = curation_db.get_cursor(connection)
+
+    with metrics.phase('main_query'):
+        cursor.execute(curation_queue_data_sql)
 
-    csvout.writerow(curation_queue_attr_list)
+        curation_queue_data = cursor.fetchall()
 
-    db_handler = DBConnection.gwasCatalogDbConnector(database_name)
-    cursor = db_handler.cursor
-    cursor.execute(curation_queue_data_sql)
+    with metrics.phase('study_enrichment'):
+        for data in tqdm(curation_queue_data, desc='Get Curation Queue data'):
 
-    curation_queue_data = cursor.fetchall()
+            curation_data = []
 
-    for data in tqdm(curation_queue_data, desc='Get Curation Queue data'):
+            curation_data.insert(0, data[0])
 
-        curation_data = []
+            curation_data.insert(1, data[1])
 
-        curation_data.insert(0, data[0])
+            curation_data.insert(2, data[2])
 
-        curation_data.insert(1, data[1])
+            curation_data.insert(3, data[3])
 
-        curation_data.insert(2, data[2])
+            curation_data.insert(4, data[4])
 
-        curation_data.insert(3, data[3])
+            curation_data.insert(5, data[5])
 
-        curation_data.insert(4, data[4])
+            curation_data.insert(6, data[6])
 
-        curation_data.insert(5, data[5])
+            curation_data.insert(12, data[7])
 
-        curation_data.insert(6, data[6])
+            curation_data.insert(13, data[8])
 
-        curation_data.insert(12, data[7])
+            curation_data.insert(14, data[9])
 
-        curation_data.insert(13, data[8])
+            curation_data.insert(15, data[10])
 
-        curation_data.insert(14, data[9])
+            curation_data.insert(16, data[11])
 
-        curation_data.insert(15, data[10])
+            curation_data.insert(17, data[12])
 
-        curation_data.insert(16, data[11])
+            ##########################
+            # Get Reported Trait
+            ##########################
+            cursor.prepare(study_reported_trait_sql)
+            cursor.execute(None, {'study_id': data[0]})
+            reported_trait = cursor.fetchone()
 
-        curation_data.insert(17, data[12])
 
-        ##########################
-        # Get Reported Trait
-        ##########################
-        cursor.prepare(study_reported_trait_sql)
-        cursor.execute(None, {'study_id': data[0]})
-        reported_trait = cursor.fetchone()
+            if reported_trait[0] is None:
+                curation_data.insert(7, 'No values')
+            else:
+                curation_data.insert(7, reported_trait[0])
 
 
-        if reported_trait[0] is None:
-            curation_data.insert(7, 'No values')
-        else:
-            curation_data.insert(7, reported_trait[0])
+            ##########################
+            # Get Mapped/EFO Trait
+            ##########################
+            cursor.prepare(study_mapped_trait_sql)
+            cursor.execute(None, {'study_id': data[0]})
+            mapped_trait = cursor.fetchone()
 
+            if mapped_trait[0] is None:
+                curation_data.insert(8,'No values')
+            else:
+                curation_data.insert(8, mapped_trait[0])
 
-        ##########################
-        # Get Mapped/EFO Trait
-        ##########################
-        cursor.prepare(study_mapped_trait_sql)
-        cursor.execute(None, {'study_id': data[0]})
-        mapped_trait = cursor.fetchone()
 
-        if mapped_trait[0] is None:
-            curation_data.insert(8,'No values')
-        else:
-            curation_data.insert(8, mapped_trait[0])
+            ##########################
+            # Get Association count
+            ##########################
+            cursor.prepare(study_association_cnt_sql)
+            cursor.execute(None, {'study_id': data[0]})
+            association_cnt = cursor.fetchone()
 
+            curation_data.insert(9, association_cnt[0])
 
-        ##########################
-        # Get Association count
-        ##########################
-        cursor.prepare(study_association_cnt_sql)
-        cursor.execute(None, {'study_id': data[0]})
-        association_cnt = cursor.fetchone()
 
-        curation_data.insert(9, association_cnt[0])
+            ###############################
+            # Get Num Individuals Initial
+            ###############################
+            cursor.prepare(study_ancestry_initial_sql)
+            cursor.execute(None, {'study_id': data[0]})
+            ancestry_initial_cnt = cursor.fetchone()
 
+            if ancestry_initial_cnt[0] is None:
+                curation_data.insert(10, 'No values')
+            else:
+                curation_data.insert(10, ancestry_initial_cnt[0])
 
-        ###############################
-        # Get Num Individuals Initial
-        ###############################
-        cursor.prepare(study_ancestry_initial_sql)
-        cursor.execute(None, {'study_id': data[0]})
-        ancestry_initial_cnt = cursor.fetchone()
 
-        if ancestry_initial_cnt[0] is None:
-            curation_data.insert(10, 'No values')
-        else:
-            curation_data.insert(10, ancestry_initial_cnt[0])
+            #########################################
+            # Get Num Individuals Replication
+            #########################################
+            cursor.prepare(study_ancestry_replication_sql)
+            cursor.execute(None, {'study_id': data[0]})
+            ancestry_replication_cnt = cursor.fetchone()
 
+            if ancestry_replication_cnt[0] is None:
+                curation_data.insert(11, 'No values')
+            else:
+                curation_data.insert(11, ancestry_replication_cnt[0])
 
-        #########################################
-        # Get Num Individuals Replication
-        #########################################
-        cursor.prepare(study_ancestry_replication_sql)
-        cursor.execute(None, {'study_id': data[0]})
-        ancestry_replication_cnt = cursor.fetchone()
 
-        if ancestry_replication_cnt[0] is None:
-            curation_data.insert(11, 'No values')
-        else:
-            curation_data.insert(11, ancestry_replication_cnt[0])
+            all_curation_queue_data.append(curation_data)
 
+    cursor.close()
+    db_pool.release(connection)
 
-        ###############################
-        # Write out row data to file
-        ##############################
-        csvout.writerow(curation_data)
+    ###############################
+    # Write out row data to file
+    ##############################
+    with metrics.phase('write'):
+        TIMESTAMP = get_timestamp()
+        with open("data_queue_"+TIMESTAMP+".csv", "w") as outfile:
+            csvout = csv.writer(outfile)
 
-    db_handler.close()
+            csvout.writerow(curation_queue_attr_list)
+            csvout.writerows(all_curation_queue_data)
+
+    ###############################
+    # Add rows to snapshot archive
+    ###############################
+    if archive_dir:
+        with metrics.phase('archive'):
+            # Best effort, a full disk or bad archive directory must not stop the email
+            try:
+                from queue_snapshot_archive import QueueSnapshotArchive
+                QueueSnapshotArchive(archive_dir).append(TIMESTAMP, curation_queue_attr_list, all_curation_queue_data)
+            except Exception as exception:
+                print('Could not add the Curation Queue snapshot to ' + archive_dir + ': ' + str(exception), file=sys.stderr)
+
+    metrics.rows = len(all_curation_queue_data)
     return all_curation_queue_data
 
 
+def get_curation_queue_pmids(database_name):
+    '''
+    Get the distinct PubMed Ids of all publications in the Curation Queue.
+    '''
+
+    curation_queue_pmids_sql = """
+        SELECT DISTINCT P.PUBMED_ID
+        FROM STUDY S, HOUSEKEEPING H, PUBLICATION P, AUTHOR A, CURATION_STATUS CS
+        WHERE S.HOUSEKEEPING_ID = H.ID AND H.IS_PUBLISHED = 0
+          and S.PUBLICATION_ID=P.ID and P.FIRST_AUTHOR_ID=A.ID and H.CURATION_STATUS_ID=CS.ID
+        ORDER BY P.PUBMED_ID
+    """
+
+    db_pool = curation_db.get_pool(database_name)
+    connection = db_pool.acquire()
+    cursor = curation_db.get_cursor(connection)
+    cursor.execute(curation_queue_pmids_sql)
+
+    curation_queue_pmids = [data[0] for data in cursor.fetchall()]
+
+    cursor.close()
+    db_pool.release(connection)
+    return curation_queue_pmids
+
+
 def get_timestamp():
     """
     Get timestamp of current date and time.
@@ -238,6 +297,24 @@ def send_email(*args):
     s.quit()
 
 
+def main(database_name, metrics_history=curation_metrics.DEFAULT_HISTORY_FILE, metrics_textfile_dir=None,
+         archive_dir=None):
+    '''
+    Create the Curation Queue file and email it to curators.
+    '''
+    metrics = curation_metrics.RunMetrics('curation_queue')
+
+    # Metrics are written for failed runs too, so that failures can be alerted on
+    with metrics.record(metrics_history, metrics_textfile_dir):
+        curation_queue_data = get_curation_queue_data(database_name=database_name, metrics=metrics, archive_dir=archive_dir)
+
+        # Email data to curators
+        TIMESTAMP = get_timestamp()
+        report_filename = "data_queue_"+TIMESTAMP+".csv"
+        with metrics.phase('email'):
+            send_email(report_filename)
+
+
 if __name__ == '__main__':
     '''
     Create curation metrics.
@@ -245,15 +322,9 @@ if __name__ == '__main__':
 
     # Commandline arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('--database', default='spotpro', choices=['dev3', 'spotpro'],
-                        help='Run as (default: spotpro).')
+    curation_arguments.add_queue_arguments(parser)
     args = parser.parse_args()
 
-    database_name = args.database
-
-    curation_queue_data = get_curation_queue_data(database_name=database_name)
+    curation_arguments.use_source(args)
 
-    # Email data to curators
-    TIMESTAMP = get_timestamp()
-    report_filename = "data_queue_"+TIMESTAMP+".csv"
-    send_email(report_filename)
\ No newline at end of file
+    main(args.database, args.metrics_history, args.metrics_textfile_dir, args.archive_dir)
@@ -0,0 +1,322 @@
+'''
+Archive of the daily Curation Queue snapshots.
+
+    python queue_snapshot_archive.py --archive_dir DIR import data_queue_*.csv
+    python queue_snapshot_archive.py --archive_dir DIR dwell [--study_id ID ...]
+    python queue_snapshot_archive.py --archive_dir DIR backlog [--start_date D] [--end_date D]
+
+Each snapshot is one file per date, snapshot_date=YYYY-MM-DD.qsnap, stored
+column by column. Every column is zlib compressed on its own, so a query
+only reads and decompresses the columns it needs. Integer columns are kept
+as arrays, all other columns are dictionary encoded: the distinct values
+once, and an array of small integer codes per row.
+'''
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from collections import Counter
+
+
+FILE_MAGIC = b'GWASQSNAP1\n'
+FILE_EXTENSION = '.qsnap'
+PARTITION_PATTERN = re.compile(r'^snapshot_date=(\d{4}-\d{2}-\d{2})' + re.escape(FILE_EXTENSION) + '$')
+CSV_DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+STUDY_ID_COLUMN = 'STUDY_ID'
+CURATION_STATUS_COLUMN = 'CURATION_STATUS'
+
+# Columns the queue script gives as numbers, all others are text even when all digits (e.g. PUBMEDID)
+INTEGER_COLUMNS = set(['STUDY_ID', 'USER_REQ$UESTED?', 'FULL P-VALUE SET?', 'IS_OPEN_TARGETS?', 'ASSOCIATION_COUNT',
+                       'NUMBER_OF_INDIVIDUALS_INITIAL', 'NUMBER_OF_INDIVIDUALS_REPLICATION'])
+
+
+def _to_archive_value(value):
+    ''' Convert a database value to one stored in the archive '''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _from_csv_value(name, value):
+    ''' Read back a value of a data_queue CSV file, as the queue script would have given it '''
+    if value == '':
+        return None
+    if name in INTEGER_COLUMNS and value.lstrip('-').isdigit():
+        return int(value)
+    return value
+
+
+def _code_typecode(dictionary_size):
+    ''' Smallest array type for the codes of a dictionary '''
+    if dictionary_size <= 1 << 8:
+        return 'B'
+    if dictionary_size <= 1 << 16:
+        return 'H'
+    return 'I'
+
+
+def _encode_column(values):
+    ''' Encode one column, returns (column header, list of compressed blocks) '''
+    if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        data = array('q', values)
+        return {'encoding': 'int'}, [zlib.compress(data.tobytes())]
+
+    dictionary = []
+    codes_by_value = {}
+    codes = []
+    for value in values:
+        code = codes_by_value.get(value)
+        if code is None:
+            code = codes_by_value[value] = len(dictionary)
+            dictionary.append(value)
+        codes.append(code)
+
+    typecode = _code_typecode(len(dictionary))
+    data = array(typecode, codes)
+    return ({'encoding': 'dictionary', 'typecode': typecode},
+            [zlib.compress(json.dumps(dictionary).encode('utf-8')), zlib.compress(data.tobytes())])
+
+
+class QueueSnapshotArchive:
+    ''' Date partitioned, columnar archive of the Curation Queue snapshots
+
+    Args:
+        archive_dir: directory holding one file per snapshot date
+    '''
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+
+    def _partition_file(self, snapshot_date):
+        return os.path.join(self.archive_dir, 'snapshot_date=' + str(snapshot_date) + FILE_EXTENSION)
+
+    def snapshot_dates(self, start_date=None, end_date=None):
+        ''' Sorted dates (YYYY-MM-DD strings) of the snapshots in the archive, optionally within a date range '''
+        if not os.path.isdir(self.archive_dir):
+            return []
+
+        snapshot_dates = []
+        for file_name in os.listdir(self.archive_dir):
+            match = PARTITION_PATTERN.match(file_name)
+            if not match:
+                continue
+            snapshot_date = match.group(1)
+            if (start_date is None or snapshot_date >= str(start_date)) and (end_date is None or snapshot_date <= str(end_date)):
+                snapshot_dates.append(snapshot_date)
+        return sorted(snapshot_dates)
+
+    def append(self, snapshot_date, header, rows):
+        ''' Add the snapshot of a date to the archive
+
+        A second snapshot of the same date, e.g. from a rerun, replaces the first.
+
+        Args:
+            snapshot_date: date of the snapshot, date or YYYY-MM-DD string
+            header: column names
+            rows: rows of values in header order
+        '''
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        columns = []
+        blocks = []
+        offset = 0
+        for position, name in enumerate(header):
+            column, column_blocks = _encode_column([_to_archive_value(row[position]) for row in rows])
+            column['name'] = name
+            column['blocks'] = []
+            for block in column_blocks:
+                column['blocks'].append([offset, len(block)])
+                offset += len(block)
+            columns.append(column)
+            blocks.extend(column_blocks)
+
+        file_header = json.dumps({'snapshot_date': str(snapshot_date), 'row_count': len(rows),
+                                  'byteorder': sys.byteorder, 'columns': columns}).encode('utf-8')
+
+        # Write then rename, so a snapshot is never read half written
+        partition_file = self._partition_file(snapshot_date)
+        with open(partition_file + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(FILE_MAGIC)
+            snapshot_file.write(struct.pack('>I', len(file_header)))
+            snapshot_file.write(file_header)
+            for block in blocks:
+                snapshot_file.write(block)
+        os.replace(partition_file + '.tmp', partition_file)
+
+    def _read_header(self, snapshot_file):
+        if snapshot_file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(snapshot_file.name + ' is not a Curation Queue snapshot')
+        header_length = struct.unpack('>I', snapshot_file.read(4))[0]
+        file_header = json.loads(snapshot_file.read(header_length).decode('utf-8'))
+        file_header['data_offset'] = len(FILE_MAGIC) + 4 + header_length
+        return file_header
+
+    def _read_block(self, snapshot_file, file_header, offset, length):
+        snapshot_file.seek(file_header['data_offset'] + offset)
+        return zlib.decompress(snapshot_file.read(length))
+
+    def _read_array(self, snapshot_file, file_header, typecode, block):
+        data = array(typecode)
+        data.frombytes(self._read_block(snapshot_file, file_header, *block))
+        if file_header['byteorder'] != sys.byteorder:
+            data.byteswap()
+        return data
+
+    def read_encoded_columns(self, snapshot_date, names):
+        ''' Read columns of a snapshot without decoding them
+
+        Returns:
+            dictionary of column name to (dictionary, codes) for dictionary
+            encoded columns and (None, values) for integer columns. Columns
+            missing from the snapshot are left out.
+        '''
+        encoded_columns = {}
+        with open(self._partition_file(snapshot_date), 'rb') as snapshot_file:
+            file_header = self._read_header(snapshot_file)
+
+            for column in file_header['columns']:
+                if column['name'] not in names:
+                    continue
+                if column['encoding'] == 'int':
+                    encoded_columns[column['name']] = (None, self._read_array(snapshot_file, file_header, 'q', column['blocks'][0]))
+                else:
+                    dictionary = json.loads(self._read_block(snapshot_file, file_header, *column['blocks'][0]).decode('utf-8'))
+                    codes = self._read_array(snapshot_file, file_header, column['typecode'], column['blocks'][1])
+                    encoded_columns[column['name']] = (dictionary, codes)
+        return encoded_columns
+
+    def read_columns(self, snapshot_date, names):
+        ''' Read columns of a snapshot as dictionary of column name to list of values '''
+        columns = {}
+        for name, (dictionary, values) in self.read_encoded_columns(snapshot_date, names).items():
+            columns[name] = list(values) if dictionary is None else [dictionary[code] for code in values]
+        return columns
+
+    def study_dwell_times(self, study_ids=None, start_date=None, end_date=None):
+        ''' How long studies have been in the Curation Queue
+
+        Args:
+            study_ids: studies to report on, all studies if not given
+
+        Returns:
+            dictionary of study id to a dictionary of first_seen and last_seen
+            snapshot dates, days_in_queue between them (both days included),
+            snapshots the study is in and in_queue, whether it is in the
+            latest snapshot of the range
+        '''
+        if study_ids is not None:
+            study_ids = set(int(study_id) for study_id in study_ids)
+
+        snapshot_dates = self.snapshot_dates(start_date, end_date)
+        first_seen = {}
+        last_seen = {}
+        snapshot_counts = Counter()
+
+        for snapshot_date in snapshot_dates:
+            dictionary, values = self.read_encoded_columns(snapshot_date, [STUDY_ID_COLUMN]).get(STUDY_ID_COLUMN, (None, []))
+            snapshot_study_ids = set(values) if dictionary is None else set(dictionary[code] for code in values)
+            if study_ids is not None:
+                snapshot_study_ids &= study_ids
+
+            for study_id in snapshot_study_ids:
+                first_seen.setdefault(study_id, snapshot_date)
+                last_seen[study_id] = snapshot_date
+            snapshot_counts.update(snapshot_study_ids)
+
+        dwell_times = {}
+        for study_id, first_date in first_seen.items():
+            days_in_queue = (datetime.date.fromisoformat(last_seen[study_id]) - datetime.date.fromisoformat(first_date)).days + 1
+            dwell_times[study_id] = {
+                'first_seen': first_date,
+                'last_seen': last_seen[study_id],
+                'days_in_queue': days_in_queue,
+                'snapshots': snapshot_counts[study_id],
+                'in_queue': last_seen[study_id] == snapshot_dates[-1],
+            }
+        return dwell_times
+
+    def backlog_by_status(self, start_date=None, end_date=None):
+        ''' Number of studies in the Curation Queue by curation status, per snapshot
+
+        Returns:
+            list of (snapshot date, dictionary of curation status to study count)
+            tuples in date order
+        '''
+        backlog = []
+        for snapshot_date in self.snapshot_dates(start_date, end_date):
+            dictionary, codes = self.read_encoded_columns(snapshot_date, [CURATION_STATUS_COLUMN]).get(CURATION_STATUS_COLUMN, (None, []))
+            # Counted on the codes, the status strings themselves are never built per row
+            code_counts = Counter(codes)
+            status_counts = {}
+            for code, count in code_counts.items():
+                status = code if dictionary is None else dictionary[code]
+                status_counts[status] = status_counts.get(status, 0) + count
+            backlog.append((snapshot_date, status_counts))
+        return backlog
+
+    def import_csv(self, csv_file):
+        ''' Add a data_queue_<date>.csv file written by the queue script to the archive '''
+        match = CSV_DATE_PATTERN.search(os.path.basename(csv_file))
+        if not match:
+            raise ValueError('No YYYY-MM-DD date in the name of ' + csv_file)
+
+        with open(csv_file, newline='') as infile:
+            reader = csv.reader(infile)
+            header = next(reader)
+            rows = [[_from_csv_value(name, value) for name, value in zip(header, row)] for row in reader]
+
+        self.append(match.group(1), header, rows)
+        return match.group(1), len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archive_dir', required=True, help='Directory of the snapshot archive.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    import_parser = subparsers.add_parser('import', help='Add existing data_queue_<date>.csv files to the archive.')
+    import_parser.add_argument('csv_files', nargs='+')
+
+    dwell_parser = subparsers.add_parser('dwell', help='Time each study has spent in the Curation Queue.')
+    dwell_parser.add_argument('--study_id', type=int, nargs='*', default=None, help='Studies to report on (default: all).')
+
+    backlog_parser = subparsers.add_parser('backlog', help='Studies in the Curation Queue by curation status per snapshot.')
+
+    for query_parser in [dwell_parser, backlog_parser]:
+        query_parser.add_argument('--start_date', default=None, help='First snapshot date, YYYY-MM-DD.')
+        query_parser.add_argument('--end_date', default=None, help='Last snapshot date, YYYY-MM-DD.')
+    args = parser.parse_args()
+
+    archive = QueueSnapshotArchive(args.archive_dir)
+    csvout = csv.writer(sys.stdout)
+
+    if args.command == 'import':
+        for csv_file in sorted(args.csv_files):
+            snapshot_date, row_count = archive.import_csv(csv_file)
+            print(snapshot_date + ': ' + str(row_count) + ' rows', file=sys.stderr)
+
+    elif args.command == 'dwell':
+        dwell_times = archive.study_dwell_times(args.study_id, args.start_date, args.end_date)
+        csvout.writerow(['STUDY_ID', 'FIRST_SEEN', 'LAST_SEEN', 'DAYS_IN_QUEUE', 'SNAPSHOTS', 'IN_QUEUE'])
+        for study_id, dwell_time in sorted(dwell_times.items(), key=lambda item: -item[1]['days_in_queue']):
+            csvout.writerow([study_id, dwell_time['first_seen'], dwell_time['last_seen'], dwell_time['days_in_queue'],
+                             dwell_time['snapshots'], dwell_time['in_queue']])
+
+    elif args.command == 'backlog':
+        backlog = archive.backlog_by_status(args.start_date, args.end_date)
+        statuses = sorted(set(str(status) for snapshot_date, status_counts in backlog for status in status_counts))
+        csvout.writerow(['SNAPSHOT_DATE'] + statuses + ['TOTAL'])
+        for snapshot_date, status_counts in backlog:
+            counts = {str(status): count for status, count in status_counts.items()}
+            csvout.writerow([snapshot_date] + [counts.get(status, 0) for status in statuses] + [sum(counts.values())])
@@ -0,0 +1,107 @@
+'''
+Command line options of the curation scripts.
+
+Each option is defined once here and used both by the script itself and
+by the matching gwas_curation.py subcommand. Nothing heavy is imported,
+so the options can be added without importing cx_Oracle or the scripts.
+'''
+
+import argparse
+
+import curation_metrics
+
+
+DEFAULT_REPLICA_HELP = '~/.gwas_curation/curation_replica.sqlite'
+
+TRAIT_ACTIONS = ['dump', 'analyze', 'dedupe', 'upload']
+
+
+def positive_int(value):
+    ''' argparse type of counts that must be at least 1 '''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, got ' + value)
+    return number
+
+
+def add_source_arguments(parser):
+    parser.add_argument('--source', default='production', choices=['production', 'local'],
+                        help='Read from the curation database or the local replica (default: production).')
+    parser.add_argument('--replica', default=None,
+                        help='Local replica file for --source local (default: ' + DEFAULT_REPLICA_HELP + ').')
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics_history', default=curation_metrics.DEFAULT_HISTORY_FILE,
+                        help='JSON lines file run metrics are appended to (default: ' + curation_metrics.DEFAULT_HISTORY_FILE + ').')
+    parser.add_argument('--metrics_textfile_dir', default=None,
+                        help='Prometheus textfile collector directory to write run metrics to.')
+
+
+def use_source(args):
+    ''' Point the scripts at the local replica for --source local '''
+    if args.source == 'local':
+        import curation_db
+        curation_db.use_local_replica(args.replica or curation_db.DEFAULT_REPLICA_FILE)
+
+
+def add_queue_arguments(parser):
+    ''' Options of curation_queue_with_ancestry.py '''
+    parser.add_argument('--database', default='SPOTPRO', choices=['DEV3', 'SPOTPRO'], type=str.upper,
+                        help='Run as (default: SPOTPRO).')
+    parser.add_argument('--archive_dir', default=None,
+                        help='Also add the rows to the Curation Queue snapshot archive in this directory.')
+    add_metrics_arguments(parser)
+    add_source_arguments(parser)
+
+
+def add_review_arguments(parser):
+    ''' Options of check_studydesign_sampleinfo.py '''
+    parser.add_argument('--database', default='SPOTPRO', choices=['SPOTPRO'], type=str.upper,
+                        help='Run as (default: SPOTPRO).')
+    parser.add_argument('--pmid', default='28256260', help='Add Pubmed Identifier, e.g. 28256260.')
+    parser.add_argument('--ancestry', default='collapsed', choices=['collapsed', 'expanded', 'both'],
+                        help='Run as (default: collapsed), both writes the collapsed and expanded files in one run.')
+    parser.add_argument('--username', default='gwas-curator', help='Run as (default: gwas-curator).')
+    parser.add_argument('--queue', action='store_true',
+                        help='Create review files for all publications in the Curation Queue, ignores --pmid.')
+    parser.add_argument('--processes', type=positive_int, default=4,
+                        help='Number of worker processes in --queue mode (default: 4).')
+    add_source_arguments(parser)
+
+
+def add_traits_arguments(parser, positional_action=False):
+    ''' Options of analyze_reported_traits.py
+
+    Args:
+        positional_action: take the action as the first argument, as
+        gwas_curation.py does, instead of as --action
+    '''
+    action_help = 'Task to perform: ' + ', '.join(TRAIT_ACTIONS) + '.'
+    if positional_action:
+        parser.add_argument('action', choices=TRAIT_ACTIONS, help=action_help)
+    else:
+        parser.add_argument('--action', choices=TRAIT_ACTIONS, help=action_help)
+    parser.add_argument('--curation_db', '--database', dest='curation_db', required=True, type=str.upper,
+                        help='Name of the database for extracting study data.')
+    parser.add_argument('--match_mode', default='levenshtein', choices=['levenshtein', 'token'],
+                        help='How analyze compares traits: levenshtein (characters) or token (words, any order) '
+                             '(default: levenshtein).')
+    parser.add_argument('--analysis_cache', default=None,
+                        help='File of the analyze results cache (default: ~/.gwas_curation/analysis_cache.sqlite).')
+    parser.add_argument('--upload_journal', default=None,
+                        help='Upload in chunks, recording each committed chunk in this file. '
+                             'Rerun with the same file to resume an interrupted upload.')
+    parser.add_argument('--upload_chunk_size', type=positive_int, default=100,
+                        help='Number of traits committed at a time with --upload_journal (default: 100).')
+    add_metrics_arguments(parser)
+    add_source_arguments(parser)
+
+
+def add_sync_arguments(parser):
+    ''' Options of curation_replica.py '''
+    parser.add_argument('--database', default='SPOTPRO', type=str.upper,
+                        help='Database to copy from (default: SPOTPRO).')
+    parser.add_argument('--replica', default=None,
+                        help='Replica file (default: ' + DEFAULT_REPLICA_HELP + ').')
+    parser.add_argument('--full', action='store_true', help='Copy every table again instead of only the changes.')
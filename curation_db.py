@@ -0,0 +1,120 @@
+'''
+Shared database connection handling for the curation scripts.
+
+Connections are taken from a cx_Oracle session pool, one pool per database
+and process, so that short jobs do not pay for a new login on every query.
+After use_local_replica() connections read the local SQLite replica made
+by curation_replica.py instead.
+'''
+
+import cx_Oracle
+import contextlib
+import os
+import sys
+
+sys.path.insert(0, '/path/to/gwas_data_sources')
+import gwas_data_sources
+
+
+# Session pool settings
+POOL_MIN = 1
+POOL_MAX = 4
+POOL_INCREMENT = 1
+
+# Seconds a pooled connection may be idle before it is pinged on acquire
+PING_INTERVAL = 60
+
+# Number of statements kept parsed per connection
+STMT_CACHE_SIZE = 40
+
+# Rows fetched per round trip
+ARRAYSIZE = 1000
+PREFETCHROWS = 1000
+
+
+_pools = {}
+_pools_pid = None
+
+# Replica file read instead of the database, see use_local_replica()
+LOCAL_REPLICA = None
+DEFAULT_REPLICA_FILE = os.path.join(os.path.expanduser('~'), '.gwas_curation', 'curation_replica.sqlite')
+
+
+def use_local_replica(replica_file):
+    '''
+    Read from the local replica instead of the curation database.
+    '''
+    global LOCAL_REPLICA
+    LOCAL_REPLICA = replica_file
+
+
+def get_pool(database_name, pool_min=POOL_MIN, pool_max=POOL_MAX):
+    '''
+    Get the session pool for a database, creating it on first use.
+
+    Args:
+        database_name: database alias, e.g. SPOTPRO
+        pool_min, pool_max: pool size, only used when the pool is created
+    '''
+    global _pools_pid
+
+    # Pools cannot be shared with forked worker processes
+    if _pools_pid != os.getpid():
+        _pools.clear()
+        _pools_pid = os.getpid()
+
+    if LOCAL_REPLICA:
+        import curation_replica
+        return curation_replica.LocalReplicaPool(LOCAL_REPLICA)
+
+    database_name = database_name.upper()
+
+    if database_name not in _pools:
+        ip, port, sid, username, password = gwas_data_sources.get_db_properties(database_name)
+        dsn_tns = cx_Oracle.makedsn(ip, port, sid)
+
+        _pools[database_name] = cx_Oracle.SessionPool(
+            user=username, password=password, dsn=dsn_tns,
+            min=pool_min, max=pool_max, increment=POOL_INCREMENT,
+            getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+            stmtcachesize=STMT_CACHE_SIZE,
+            ping_interval=PING_INTERVAL,
+            threaded=True)
+
+    return _pools[database_name]
+
+
+@contextlib.contextmanager
+def connect(database_name):
+    '''
+    Acquire a pooled connection, released back to the pool on exit.
+
+    Example:
+        with curation_db.connect('SPOTPRO') as connection:
+            ...
+    '''
+    pool = get_pool(database_name)
+    connection = pool.acquire()
+    try:
+        yield connection
+    finally:
+        pool.release(connection)
+
+
+def get_cursor(connection, arraysize=ARRAYSIZE, prefetchrows=PREFETCHROWS):
+    '''
+    Open a cursor with the fetch buffer sizes set.
+    '''
+    cursor = connection.cursor()
+    cursor.arraysize = arraysize
+    cursor.prefetchrows = prefetchrows
+    return cursor
+
+
+def close_pools():
+    '''
+    Close all session pools opened by this process.
+    '''
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
@@ -0,0 +1,147 @@
+'''
+Run metrics for the curation jobs.
+
+Records how long each phase of a run took, how many rows it produced, its
+peak memory and whether it succeeded, and writes them to a JSON lines history file and to a
+Prometheus textfile collector file so that nightly runs can be alerted on.
+'''
+
+import contextlib
+import datetime
+import json
+import os
+import resource
+import sys
+import time
+
+
+DEFAULT_HISTORY_FILE = 'curation_metrics_history.jsonl'
+
+
+def get_peak_rss_bytes():
+    ''' Peak resident memory of this process and its finished child processes '''
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+class RunMetrics:
+    ''' Metrics of one run of a job
+
+    Example:
+        metrics = RunMetrics('curation_queue')
+        with metrics.record(textfile_dir='/var/lib/node_exporter/textfile_collector'):
+            with metrics.phase('main_query'):
+                ...
+            metrics.rows = len(data)
+
+    Args:
+        job: name of the job, used as the "curation_job" label of the exported metrics
+    '''
+
+    def __init__(self, job):
+        self.job = job
+        self.start_time = time.time()
+        self._start_counter = time.perf_counter()
+        self.phases = {}
+        self.rows = 0
+        self.success = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        ''' Time a phase, repeated phases with the same name are added up '''
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - phase_start
+
+    @contextlib.contextmanager
+    def record(self, history_file=DEFAULT_HISTORY_FILE, textfile_dir=None):
+        ''' Run a job and write its metrics when it ends, whether it succeeded or failed
+
+        A sys.exit() with status 0 counts as success, any other exception as failure.
+        '''
+        self.success = False
+        try:
+            yield self
+            self.success = True
+        except SystemExit as exit_exception:
+            self.success = exit_exception.code in (None, 0)
+            raise
+        finally:
+            # Metrics must not hide the error of a failed run
+            try:
+                self.write(history_file, textfile_dir)
+            except Exception as exception:
+                print('Could not write run metrics: ' + str(exception), file=sys.stderr)
+
+    def summary(self):
+        duration = time.perf_counter() - self._start_counter
+        return {
+            'job': self.job,
+            'start_time': datetime.datetime.fromtimestamp(self.start_time).isoformat(timespec='seconds'),
+            'start_timestamp': round(self.start_time, 3),
+            'duration_seconds': round(duration, 3),
+            'phase_seconds': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'rows': self.rows,
+            'rows_per_second': round(self.rows / duration, 3) if duration else 0.0,
+            'peak_rss_bytes': get_peak_rss_bytes(),
+            'success': self.success,
+        }
+
+    def write(self, history_file=DEFAULT_HISTORY_FILE, textfile_dir=None):
+        ''' Append the run to the history file and, if a directory is given, write the Prometheus textfile '''
+        summary = self.summary()
+
+        with open(history_file, 'a') as history:
+            history.write(json.dumps(summary) + '\n')
+
+        if textfile_dir:
+            write_prometheus_textfile(summary, textfile_dir)
+
+        return summary
+
+
+def write_prometheus_textfile(summary, textfile_dir):
+    ''' Write a run summary in the Prometheus text format, replacing the file of the previous run '''
+    # Not "job", which Prometheus renames to exported_job as the scrape sets its own job label
+    job_label = 'curation_job="' + summary['job'] + '"'
+
+    lines = [
+        '# HELP gwas_curation_last_run_timestamp_seconds Start time of the last run.',
+        '# TYPE gwas_curation_last_run_timestamp_seconds gauge',
+        'gwas_curation_last_run_timestamp_seconds{' + job_label + '} ' + str(summary['start_timestamp']),
+        '# HELP gwas_curation_duration_seconds Duration of the last run.',
+        '# TYPE gwas_curation_duration_seconds gauge',
+        'gwas_curation_duration_seconds{' + job_label + '} ' + str(summary['duration_seconds']),
+        '# HELP gwas_curation_phase_duration_seconds Duration of each phase of the last run.',
+        '# TYPE gwas_curation_phase_duration_seconds gauge',
+    ]
+    for name, seconds in summary['phase_seconds'].items():
+        lines.append('gwas_curation_phase_duration_seconds{' + job_label + ',phase="' + name + '"} ' + str(seconds))
+
+    lines += [
+        '# HELP gwas_curation_rows Rows produced by the last run.',
+        '# TYPE gwas_curation_rows gauge',
+        'gwas_curation_rows{' + job_label + '} ' + str(summary['rows']),
+        '# HELP gwas_curation_rows_per_second Rows per second of the last run.',
+        '# TYPE gwas_curation_rows_per_second gauge',
+        'gwas_curation_rows_per_second{' + job_label + '} ' + str(summary['rows_per_second']),
+        '# HELP gwas_curation_peak_rss_bytes Peak resident memory of the last run.',
+        '# TYPE gwas_curation_peak_rss_bytes gauge',
+        'gwas_curation_peak_rss_bytes{' + job_label + '} ' + str(summary['peak_rss_bytes']),
+    ]
+    if summary['success'] is not None:
+        lines += [
+            '# HELP gwas_curation_last_run_success Whether the last run succeeded (1) or failed (0).',
+            '# TYPE gwas_curation_last_run_success gauge',
+            'gwas_curation_last_run_success{' + job_label + '} ' + str(int(summary['success'])),
+        ]
+
+    # Write then rename, so the collector never reads a partial file
+    textfile = os.path.join(textfile_dir, 'gwas_curation_' + summary['job'] + '.prom')
+    with open(textfile + '.tmp', 'w') as prom_file:
+        prom_file.write('\n'.join(lines) + '\n')
+    os.replace(textfile + '.tmp', textfile)
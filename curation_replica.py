@@ -0,0 +1,379 @@
+'''
+Local SQLite read replica of the curation tables used by the scripts.
+
+    python curation_replica.py --database SPOTPRO [--replica FILE] [--full]
+
+The first sync copies every table. Later syncs only copy what changed:
+small lookup tables are copied again, new authors are added by ID,
+housekeeping rows are taken by LAST_UPDATE_DATE, and all study level tables
+are refreshed for new studies and studies whose housekeeping row was
+updated. Studies deleted from the curation database are removed.
+
+The scripts read the replica with --source local. Their Oracle SQL runs
+unchanged, LISTAGG and TO_CHAR are translated for SQLite when executed.
+'''
+
+import argparse
+import contextlib
+import datetime
+import os
+import re
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import curation_arguments
+import curation_db
+
+
+DEFAULT_REPLICA_FILE = curation_db.DEFAULT_REPLICA_FILE
+
+# Small tables, copied in full on every sync
+LOOKUP_TABLES = ['CURATION_STATUS', 'PLATFORM', 'GENOTYPING_TECHNOLOGY', 'ANCESTRAL_GROUP', 'COUNTRY',
+                 'DISEASE_TRAIT', 'EFO_TRAIT', 'PUBLICATION']
+
+# Rows are never changed, new rows are added by ID
+APPEND_ONLY_TABLES = ['AUTHOR']
+
+HOUSEKEEPING_UPDATE_COLUMN = 'LAST_UPDATE_DATE'
+
+# Study level tables: table, study id column, columns to copy
+STUDY_TABLES = [
+    ('STUDY', 'ID', '*'),
+    ('STUDY_DISEASE_TRAIT', 'STUDY_ID', '*'),
+    ('STUDY_EFO_TRAIT', 'STUDY_ID', '*'),
+    ('STUDY_PLATFORM', 'STUDY_ID', '*'),
+    ('STUDY_GENOTYPING_TECHNOLOGY', 'STUDY_ID', '*'),
+    ('NOTE', 'STUDY_ID', '*'),
+    ('ANCESTRY', 'STUDY_ID', '*'),
+    # Only used for association counts
+    ('ASSOCIATION', 'STUDY_ID', 'ID, STUDY_ID'),
+]
+
+# Ancestry level tables, refreshed with the ancestries of changed studies
+ANCESTRY_TABLES = ['ANCESTRY_ANCESTRAL_GROUP', 'ANCESTRY_COUNTRY_OF_ORIGIN', 'ANCESTRY_COUNTRY_RECRUITMENT']
+
+# Oracle allows at most 1000 expressions in an IN list
+IN_LIST_SIZE = 1000
+
+SYNC_ARRAYSIZE = 5000
+
+
+#########################
+# Sync from Oracle
+#########################
+
+def _to_local_value(value):
+    ''' Convert an Oracle value to one SQLite stores '''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if hasattr(value, 'read'):
+        # LOB
+        return value.read()
+    return value
+
+
+def _chunks(values, size=IN_LIST_SIZE):
+    values = sorted(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _table_exists(local, table):
+    return local.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def _create_table(local, table, columns):
+    ''' Create a local table with the columns of an Oracle result, and indexes on its id columns '''
+    local.execute('CREATE TABLE IF NOT EXISTS "' + table + '" (' + ', '.join('"' + column + '"' for column in columns) + ')')
+    for column in columns:
+        if column == 'ID':
+            local.execute('CREATE UNIQUE INDEX IF NOT EXISTS "' + table + '_ID" ON "' + table + '" ("ID")')
+        elif column.endswith('_ID'):
+            local.execute('CREATE INDEX IF NOT EXISTS "' + table + '_' + column + '" ON "' + table + '" ("' + column + '")')
+
+
+def _copy_rows(cursor, local, table, sql, parameters=None):
+    ''' Copy the result of an Oracle query into a local table, replacing rows with the same ID '''
+    cursor.execute(sql, parameters or {})
+    columns = [description[0] for description in cursor.description]
+    _create_table(local, table, columns)
+
+    insert_sql = ('INSERT OR REPLACE INTO "' + table + '" VALUES (' + ', '.join('?' * len(columns)) + ')')
+    row_count = 0
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        local.executemany(insert_sql, [[_to_local_value(value) for value in row] for row in rows])
+        row_count += len(rows)
+    return row_count
+
+
+def _copy_rows_in(cursor, local, table, columns, id_column, ids):
+    ''' Copy the rows of an Oracle table whose id_column is in ids '''
+    row_count = 0
+    for chunk in _chunks(ids):
+        placeholders = ', '.join(':' + str(i + 1) for i in range(len(chunk)))
+        sql = 'SELECT ' + columns + ' FROM ' + table + ' WHERE ' + id_column + ' IN (' + placeholders + ')'
+        row_count += _copy_rows(cursor, local, table, sql, chunk)
+    return row_count
+
+
+def _delete_rows_in(local, table, id_column, ids):
+    if not _table_exists(local, table):
+        return
+    for chunk in _chunks(ids):
+        local.execute('DELETE FROM "' + table + '" WHERE "' + id_column + '" IN (' + ', '.join('?' * len(chunk)) + ')', chunk)
+
+
+def _local_ids(local, sql, parameters=()):
+    return set(row[0] for row in local.execute(sql, parameters))
+
+
+def _get_state(local, name):
+    row = local.execute('SELECT VALUE FROM SYNC_STATE WHERE NAME = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(local, name, value):
+    local.execute('INSERT OR REPLACE INTO SYNC_STATE VALUES (?, ?)', (name, value))
+
+
+def sync_replica(database_name, replica_file=DEFAULT_REPLICA_FILE, full=False):
+    '''
+    Bring the local replica up to date with the curation database.
+
+    Args:
+        full: copy every table again instead of only the changes
+    '''
+    directory = os.path.dirname(replica_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    local = sqlite3.connect(replica_file)
+    local.execute('CREATE TABLE IF NOT EXISTS SYNC_STATE (NAME TEXT PRIMARY KEY, VALUE TEXT)')
+
+    last_update = None if full else _get_state(local, 'HOUSEKEEPING_LAST_UPDATE')
+    is_incremental = last_update is not None and _table_exists(local, 'STUDY')
+    summary = {}
+
+    with curation_db.connect(database_name) as connection, \
+            contextlib.closing(curation_db.get_cursor(connection, SYNC_ARRAYSIZE, SYNC_ARRAYSIZE)) as cursor:
+
+        # Taken first, so that changes made during the sync are picked up next time
+        cursor.execute('SELECT MAX(' + HOUSEKEEPING_UPDATE_COLUMN + ') FROM HOUSEKEEPING')
+        sync_update = _to_local_value(cursor.fetchone()[0])
+
+        ##########################
+        # Lookup tables
+        ##########################
+        for table in LOOKUP_TABLES:
+            if _table_exists(local, table):
+                local.execute('DELETE FROM "' + table + '"')
+            summary[table] = _copy_rows(cursor, local, table, 'SELECT * FROM ' + table)
+
+        for table in APPEND_ONLY_TABLES:
+            if is_incremental and _table_exists(local, table):
+                max_id = local.execute('SELECT COALESCE(MAX(ID), 0) FROM "' + table + '"').fetchone()[0]
+                summary[table] = _copy_rows(cursor, local, table, 'SELECT * FROM ' + table + ' WHERE ID > :max_id',
+                                            {'max_id': max_id})
+            else:
+                if _table_exists(local, table):
+                    local.execute('DELETE FROM "' + table + '"')
+                summary[table] = _copy_rows(cursor, local, table, 'SELECT * FROM ' + table)
+
+        ##########################
+        # Full copy
+        ##########################
+        if not is_incremental:
+            for table in ['HOUSEKEEPING'] + [table for table, id_column, columns in STUDY_TABLES] + ANCESTRY_TABLES:
+                if _table_exists(local, table):
+                    local.execute('DELETE FROM "' + table + '"')
+
+            summary['HOUSEKEEPING'] = _copy_rows(cursor, local, 'HOUSEKEEPING', 'SELECT * FROM HOUSEKEEPING')
+            for table, id_column, columns in STUDY_TABLES:
+                summary[table] = _copy_rows(cursor, local, table, 'SELECT ' + columns + ' FROM ' + table)
+            for table in ANCESTRY_TABLES:
+                summary[table] = _copy_rows(cursor, local, table, 'SELECT * FROM ' + table)
+
+        ##########################
+        # Incremental copy
+        ##########################
+        else:
+            max_housekeeping_id = local.execute('SELECT COALESCE(MAX(ID), 0) FROM HOUSEKEEPING').fetchone()[0]
+            last_update_value = datetime.datetime.fromisoformat(last_update)
+
+            cursor.execute('SELECT ID FROM HOUSEKEEPING WHERE ' + HOUSEKEEPING_UPDATE_COLUMN + ' > :last_update OR ID > :max_id',
+                           {'last_update': last_update_value, 'max_id': max_housekeeping_id})
+            updated_housekeeping_ids = set(row[0] for row in cursor.fetchall())
+            summary['HOUSEKEEPING'] = _copy_rows_in(cursor, local, 'HOUSEKEEPING', '*', 'ID', updated_housekeeping_ids)
+
+            cursor.execute('SELECT ID, HOUSEKEEPING_ID FROM STUDY')
+            remote_studies = dict(cursor.fetchall())
+            local_study_ids = _local_ids(local, 'SELECT ID FROM STUDY')
+
+            deleted_study_ids = local_study_ids - set(remote_studies)
+            changed_study_ids = set(study_id for study_id, housekeeping_id in remote_studies.items()
+                                    if study_id not in local_study_ids or housekeeping_id in updated_housekeeping_ids)
+            refreshed_study_ids = changed_study_ids | deleted_study_ids
+
+            # Ancestries currently stored for the studies about to be replaced
+            old_ancestry_ids = set()
+            for chunk in _chunks(refreshed_study_ids):
+                old_ancestry_ids |= _local_ids(local, 'SELECT ID FROM ANCESTRY WHERE STUDY_ID IN (' + ', '.join('?' * len(chunk)) + ')', chunk)
+
+            for table, id_column, columns in STUDY_TABLES:
+                _delete_rows_in(local, table, id_column, refreshed_study_ids)
+                summary[table] = _copy_rows_in(cursor, local, table, columns, id_column, changed_study_ids)
+
+            new_ancestry_ids = set()
+            for chunk in _chunks(changed_study_ids):
+                new_ancestry_ids |= _local_ids(local, 'SELECT ID FROM ANCESTRY WHERE STUDY_ID IN (' + ', '.join('?' * len(chunk)) + ')', chunk)
+
+            for table in ANCESTRY_TABLES:
+                _delete_rows_in(local, table, 'ANCESTRY_ID', old_ancestry_ids)
+                summary[table] = _copy_rows_in(cursor, local, table, '*', 'ANCESTRY_ID', new_ancestry_ids)
+
+            summary['deleted studies'] = len(deleted_study_ids)
+
+    if sync_update is not None:
+        _set_state(local, 'HOUSEKEEPING_LAST_UPDATE', sync_update)
+    _set_state(local, 'LAST_SYNC', datetime.datetime.now().isoformat(sep=' ', timespec='seconds'))
+
+    local.commit()
+    local.close()
+    return summary
+
+
+#########################
+# Reading the replica
+#########################
+
+LISTAGG_PATTERN = re.compile(r"listagg\(([^()]*)\)\s*WITHIN\s+GROUP\s*\(\s*ORDER\s+BY\s+([^()]*?)\s*\)", re.IGNORECASE)
+LISTAGG_SEPARATOR_PATTERN = re.compile(r"^(.*?),\s*('[^']*')\s*$")
+
+
+def _translate_listagg(match):
+    arguments, order_by = match.group(1), match.group(2)
+    separator_match = LISTAGG_SEPARATOR_PATTERN.match(arguments)
+    if separator_match:
+        expression, separator = separator_match.group(1), separator_match.group(2)
+    else:
+        expression, separator = arguments, "''"
+    return 'LISTAGG_ORDERED(' + expression + ', ' + separator + ', ' + order_by + ')'
+
+
+def translate_sql(sql):
+    ''' Rewrite the Oracle SQL used by the scripts for SQLite '''
+    return LISTAGG_PATTERN.sub(_translate_listagg, sql)
+
+
+class ListAggOrdered:
+    ''' SQLite aggregate behaving like Oracle LISTAGG(value, separator) WITHIN GROUP (ORDER BY order) '''
+
+    def __init__(self):
+        self.values = []
+        self.separator = ''
+
+    def step(self, value, separator, order):
+        self.separator = separator
+        if value is not None:
+            self.values.append((order is None, order, str(value)))
+
+    def finalize(self):
+        if not self.values:
+            return None
+        self.values.sort()
+        return self.separator.join(value for is_null, order, value in self.values)
+
+
+def to_char(value, oracle_format):
+    ''' Oracle TO_CHAR for the date formats the scripts use, e.g. yyyy-mm-dd '''
+    if value is None:
+        return None
+    date_format = oracle_format.lower().replace('yyyy', '%Y').replace('mm', '%m').replace('dd', '%d')
+    return datetime.datetime.fromisoformat(value).strftime(date_format)
+
+
+class LocalReplicaCursor:
+    ''' Cursor over the replica with the parts of the cx_Oracle cursor API the scripts use '''
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor()
+        self._statement = None
+        self.arraysize = self._cursor.arraysize
+        self.prefetchrows = 0
+
+    def prepare(self, sql):
+        self._statement = translate_sql(sql)
+
+    def execute(self, sql, parameters=None):
+        statement = self._statement if sql is None else translate_sql(sql)
+        self._cursor.execute(statement, parameters or {})
+        return self
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class LocalReplicaConnection:
+
+    def __init__(self, replica_file):
+        if not os.path.exists(replica_file):
+            raise FileNotFoundError('No local replica at ' + replica_file + ', run curation_replica.py first')
+
+        # Read only, the replica is only changed by sync_replica()
+        self._connection = sqlite3.connect('file:' + replica_file + '?mode=ro', uri=True)
+        self._connection.create_aggregate('LISTAGG_ORDERED', 3, ListAggOrdered)
+        self._connection.create_function('TO_CHAR', 2, to_char)
+
+    def cursor(self):
+        return LocalReplicaCursor(self._connection)
+
+    def close(self):
+        self._connection.close()
+
+
+class LocalReplicaPool:
+    ''' Stands in for the session pool when reading from the replica '''
+
+    def __init__(self, replica_file):
+        self.replica_file = replica_file
+
+    def acquire(self):
+        return LocalReplicaConnection(self.replica_file)
+
+    def release(self, connection):
+        connection.close()
+
+    def drop(self, connection):
+        connection.close()
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    curation_arguments.add_sync_arguments(parser)
+    args = parser.parse_args()
+
+    for table, row_count in sync_replica(args.database, args.replica or DEFAULT_REPLICA_FILE, args.full).items():
+        print(table + ': ' + str(row_count))
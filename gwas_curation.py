@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Single entry point for the curation scripts.
+
+    gwas_curation.py queue
+    gwas_curation.py review --pmid 28256260
+    gwas_curation.py traits dump|analyze|dedupe|upload
+    gwas_curation.py sync
+
+Only the option definitions (curation_arguments.py) are imported up front.
+The script behind a subcommand, and with
+it cx_Oracle and the database connection, is loaded when that subcommand runs,
+so --help and --dry-run return without touching the database.
+'''
+
+import argparse
+import importlib
+import os.path
+import sys
+
+import curation_arguments
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_script(directory, module_name):
+    '''
+    Import a script module from one of the script directories.
+    '''
+    sys.path.insert(0, os.path.join(ROOT_DIR, directory))
+    return importlib.import_module(module_name)
+
+
+def run_queue(args):
+    curation_arguments.use_source(args)
+    queue = _load_script('curation-queue', 'curation_queue_with_ancestry')
+    queue.main(args.database, args.metrics_history, args.metrics_textfile_dir, args.archive_dir)
+
+
+def run_review(args):
+    curation_arguments.use_source(args)
+    review = _load_script('study-sample-review', 'check_studydesign_sampleinfo')
+    review.main(args.database, args.pmid, args.ancestry, args.username, args.queue, args.processes)
+
+
+def run_traits(args):
+    curation_arguments.use_source(args)
+    traits = _load_script('reported-traits', 'analyze_reported_traits')
+    traits.main(args.action, args.curation_db, args.match_mode, args.analysis_cache,
+                args.metrics_history, args.metrics_textfile_dir, args.upload_journal, args.upload_chunk_size)
+
+
+def run_sync(args):
+    import curation_replica
+    for table, row_count in curation_replica.sync_replica(args.database, args.replica or curation_replica.DEFAULT_REPLICA_FILE,
+                                                          args.full).items():
+        print(table + ': ' + str(row_count))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='gwas_curation.py', description='GWAS curation utilities.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the command that would run and exit without connecting to the database.')
+    subparsers = parser.add_subparsers(dest='command', metavar='{queue,review,traits,sync}')
+    subparsers.required = True
+
+    # Curation Queue
+    queue_parser = subparsers.add_parser('queue', help='Create the Curation Queue file and email it to curators.')
+    curation_arguments.add_queue_arguments(queue_parser)
+    queue_parser.set_defaults(func=run_queue)
+
+    # Level 2 review
+    review_parser = subparsers.add_parser('review', help='Create the Level 2 review file for a publication.')
+    curation_arguments.add_review_arguments(review_parser)
+    review_parser.set_defaults(func=run_review)
+
+    # Reported traits
+    traits_parser = subparsers.add_parser('traits', help='Dump, analyze, dedupe or upload reported traits.')
+    curation_arguments.add_traits_arguments(traits_parser, positional_action=True)
+    traits_parser.set_defaults(func=run_traits)
+
+    # Local replica
+    sync_parser = subparsers.add_parser('sync', help='Update the local replica of the curation tables.')
+    curation_arguments.add_sync_arguments(sync_parser)
+    sync_parser.set_defaults(func=run_sync)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+
+    if args.dry_run:
+        options = {key: value for key, value in vars(args).items() if key not in ('func', 'dry_run', 'command')}
+        print('Would run ' + args.command + ' with ' + str(options))
+        sys.exit()
+
+    args.func(args)
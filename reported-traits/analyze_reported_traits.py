@@ -8,10 +8,13 @@ import json
 import csv
 import logging
 from tqdm import tqdm
-from termcolor import colored
 from datetime import datetime, date
-from gwas_db_connect import DBConnection
-import Levenshtein
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import curation_arguments
+import curation_db
+import curation_metrics
+from trait_corpus import ReportedTraitCorpus, normalize_trait
 
 
 
@@ -23,6 +26,7 @@ class ReportedTraitData:
     '''
 
     def __init__(self, connection, database):
+        self.connection = connection
         self.database = database
         # self.logging_level = logging_level
 
@@ -32,18 +36,17 @@ class ReportedTraitData:
 
     def get_all_reported_traits(self):
         try:
-            with contextlib.closing(connection.cursor()) as cursor:
+            with contextlib.closing(curation_db.get_cursor(self.connection)) as cursor:
                 cursor.execute(self.ALL_REPORTED_TRAITS_SQL)
-                data = cursor.fetchall()
-                #TODO: Decide whether to keep id and trait name
-                self.data = data
+                # Shared by all actions, rows are read straight into the compact corpus
+                self.corpus = ReportedTraitCorpus(cursor)
                 logging.debug('Successfully extracted reported traits')
         except cx_Oracle.DatabaseError as exception:
             logging.error(exception)
 
     def save_all_reported_traits_file(self):
         ''' Write reported traits to file '''
-        traits = [''.join(trait[1]) for trait in self.data]
+        traits = self.corpus.traits()
         traits.sort()
 
         with open("reported_trait.csv", "w") as csvfile:
@@ -77,12 +80,8 @@ class ReportedTraitData:
                         sys.exit()
             return traits
 
-    def find_similar_reported_traits(self, user_trait_data):
-        ''' Find similar traits
-
-        Args:
-            user_trait_data: list of tuples (id, trait)
-        '''
+    def read_match_threshold(self):
+        ''' Ask for the similarity score a match must reach '''
         print('Enter the match threshold value (upper=1.0, lower=0). A match score of 1.0 is a perfect match.')
         match_threshold_value = float(input())
 
@@ -90,30 +89,64 @@ class ReportedTraitData:
             logging.warning('Exiting... Match threshold outside of accepted limit')
             sys.exit()
 
+        return match_threshold_value
+
+    def find_similar_reported_traits(self, user_trait_data, match_mode='levenshtein', cache_file=None,
+                                     match_threshold_value=None):
+        ''' Find similar traits
+
+        Args:
+            user_trait_data: list of tuples (id, trait)
+            match_mode: 'levenshtein' compares characters against every
+            existing trait, 'token' compares word sets through an inverted
+            index and ignores word order
+            cache_file: file of the analysis cache, previously analyzed
+            traits are looked up there instead of being scored again
+            match_threshold_value: asked for if not given
+        '''
+        from trait_analysis_cache import TraitAnalysisCache, DEFAULT_CACHE_FILE
+
+        if match_threshold_value is None:
+            match_threshold_value = self.read_match_threshold()
+
         logging.info('Searching for similarities...')
-        traits = [''.join(trait[1]) for trait in self.data]
+        corpus = self.corpus
+
+        if match_mode == 'token':
+            from trait_token_index import TraitTokenIndex
+            token_index = TraitTokenIndex(corpus)
+
+            def search(user_trait, start):
+                # IDF weights depend on the whole corpus, start is always 0
+                return token_index.search(user_trait, match_threshold_value)
+        else:
+            from trait_distance import BoundedRatioScorer
+            scorer = BoundedRatioScorer(corpus.normalized_traits(), match_threshold_value)
+
+            def search(user_trait, start):
+                return [(corpus.ids[position], corpus.trait(position), similarity_score)
+                        for position, similarity_score in scorer.matches(normalize_trait(user_trait), start)]
 
         similarities = {}
-        for user_trait in tqdm(user_trait_data, desc="Traits"):
-            matches_above_threshold = {}
-            is_match_found = False
-            for db_reported_trait in traits:
-                similarity_score = Levenshtein.ratio(user_trait.lower(), db_reported_trait.lower())
-
-                if similarity_score >= match_threshold_value:
-                # if similarity_score >= 0.7:
+        with contextlib.closing(TraitAnalysisCache(corpus, cache_file or DEFAULT_CACHE_FILE)) as analysis_cache:
+            for user_trait in tqdm(user_trait_data, desc="Traits"):
+                matches_above_threshold = {}
+                is_match_found = False
+
+                for trait_id, db_reported_trait, similarity_score in analysis_cache.get_matches(
+                        user_trait, match_mode, match_threshold_value, search, incremental=match_mode != 'token'):
                     is_match_found = True
                     matches_above_threshold[db_reported_trait] = '{:.2f}'.format(similarity_score)
-            
-            # Set default value if no matches are found to display in "similarity_analysis_results.csv"
-            if not is_match_found:
-                 matches_above_threshold['No matches found at threshold'] = str(match_threshold_value)
 
-            
-            # Sort list of tuples by score return list with tuple with highest score first in list
-            matches = sorted(matches_above_threshold.items(), key=lambda x: x[1], reverse=True)
+                # Set default value if no matches are found to display in "similarity_analysis_results.csv"
+                if not is_match_found:
+                     matches_above_threshold['No matches found at threshold'] = str(match_threshold_value)
+
+
+                # Sort list of tuples by score return list with tuple with highest score first in list
+                matches = sorted(matches_above_threshold.items(), key=lambda x: x[1], reverse=True)
 
-            similarities[user_trait] = matches
+                similarities[user_trait] = matches
 
         return similarities
 
@@ -138,8 +171,45 @@ class ReportedTraitData:
 
             logging.info('similarity_analysis_results.csv created')
 
-    def insert_traits(self, traits):
-        ''' Add traits to the database '''
+    def find_duplicate_reported_traits(self, match_threshold_value=None):
+        ''' Find clusters of near duplicate traits in the database
+
+        Args:
+            match_threshold_value: asked for if not given
+        '''
+        from trait_dedupe import find_duplicate_clusters
+
+        if match_threshold_value is None:
+            match_threshold_value = self.read_match_threshold()
+
+        logging.info('Searching for duplicates...')
+
+        return find_duplicate_clusters(self.corpus, match_threshold_value)
+
+    def save_duplicate_clusters_file(self, clusters):
+        ''' Save clusters of near duplicate traits
+
+        Args:
+            clusters: list of clusters, each a list of (id, trait) tuples
+        '''
+        with open("duplicate_trait_clusters.csv", "w") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Cluster', 'Reported Trait ID', 'Reported Trait'])
+
+            for cluster_number, cluster in enumerate(clusters, 1):
+                for trait_id, trait in cluster:
+                    writer.writerow([cluster_number, trait_id, trait])
+
+            logging.info('duplicate_trait_clusters.csv created with ' + str(len(clusters)) + ' clusters')
+
+    def read_upload_confirmation(self, traits):
+        ''' Ask for confirmation to add the traits
+
+        Returns:
+            'COMMIT', or 'ROLLBACK' when answered with testing
+        '''
+        from termcolor import colored
+
         logging.info('All traits to add: ' + ', '.join(traits))
 
         print(colored('Are you sure you want to add these traits to the Curation app production database? Options: yes, no', 'red', attrs=['bold']))
@@ -149,28 +219,32 @@ class ReportedTraitData:
             logging.warning('Exiting... no confirmation to upload traits')
             sys.exit()
         elif confirm_action == 'testing':
-            database_action = 'ROLLBACK'
+            return 'ROLLBACK'
         elif confirm_action == 'yes':
-            database_action = 'COMMIT'
+            return 'COMMIT'
         else:
             logging.warning('Exiting... Confirmation did not match any of the expected values')
             sys.exit()
 
+    def insert_traits(self, traits):
+        ''' Add traits to the database '''
+        database_action = self.read_upload_confirmation(traits)
+        confirm_action = 'testing' if database_action == 'ROLLBACK' else 'yes'
+
 
-        existing_traits = [''.join(trait[1].lower().strip()) for trait in self.data]
         self.database_insert_trait_results = []
 
 
         # Check if any traits to be added currently exist in the database
         for trait in traits:
-            if trait.lower() in existing_traits:
+            if trait in self.corpus:
                 print('\n')
                 logging.info(trait + ' already exists in database, skipping...')
                 self.database_insert_trait_results.append([trait, 'skip', 'NA'])
             else:
                 insert_trait_sql = 'INSERT INTO DISEASE_TRAIT VALUES (NULL, ' + "'"+trait+"'" + ')'
                 try:
-                    with contextlib.closing(connection.cursor()) as cursor:
+                    with contextlib.closing(curation_db.get_cursor(self.connection)) as cursor:
                         # Insert trait and return back the "id" primary key for the new row
                         new_id = cursor.var(cx_Oracle.NUMBER)
                         sql_event = insert_trait_sql + ' returning id into :new_id'
@@ -198,11 +272,10 @@ class ReportedTraitData:
                 Array of user provided traits (already stripped of leading/trailing whitespace).
         '''
 
-        existing_traits = [''.join(trait[1].lower().strip()) for trait in self.data]
-        user_provided_traits = [''.join(trait).lower() for trait in traits]
+        user_provided_traits = set(normalize_trait(trait) for trait in traits)
         
         # Create header summary information
-        traits_not_added = list(set(user_provided_traits) & set(existing_traits))
+        traits_not_added = [trait for trait in user_provided_traits if trait in self.corpus]
         # print('Traits not added: ', len(traits_not_added), traits_not_added)
         
         num_traits_added = len(traits) - len(traits_not_added)
@@ -221,77 +294,252 @@ class ReportedTraitData:
                 writer.writerow([trait, action, pk])
 
 
+    def find_existing_traits(self, traits):
+        ''' Look up which traits are already in the database
+
+        Returns:
+            dictionary of normalized trait to its DISEASE_TRAIT id
+        '''
+        normalized_traits = sorted(set(normalize_trait(trait) for trait in traits))
+        existing_traits = {}
+
+        with contextlib.closing(curation_db.get_cursor(self.connection)) as cursor:
+            # Oracle allows at most 1000 expressions in an IN list
+            for i in range(0, len(normalized_traits), 1000):
+                chunk = normalized_traits[i:i + 1000]
+                placeholders = ', '.join(':' + str(position + 1) for position in range(len(chunk)))
+                cursor.execute('SELECT ID, TRAIT FROM DISEASE_TRAIT WHERE LOWER(TRIM(TRAIT)) IN (' + placeholders + ')', chunk)
+                for disease_trait_id, trait in cursor:
+                    existing_traits.setdefault(normalize_trait(trait), disease_trait_id)
+
+        return existing_traits
+
+    def insert_traits_in_chunks(self, traits, journal_file, chunk_size=100):
+        ''' Add traits to the database, committing and journaling every chunk_size traits
+
+        Traits already in the journal were committed by an earlier run and are
+        left out, so an interrupted upload is resumed by running it again with
+        the same journal file. Each chunk is checked against the database
+        before it is inserted, so a chunk committed but not journaled before a
+        crash is skipped rather than added twice.
+
+        Args:
+            traits: array of user provided traits
+            journal_file: file the results of every committed chunk are appended to
+            chunk_size: number of traits per commit
+        '''
+        from trait_upload_journal import UploadJournal, ROLLBACK_ACTION, ERROR_ACTION
+
+        journal = UploadJournal(journal_file)
+        completed_traits = journal.completed_traits()
+
+        # Leave out traits uploaded by an earlier run and repeats within the file
+        traits_to_upload = []
+        for trait in traits:
+            if normalize_trait(trait) not in completed_traits:
+                completed_traits.add(normalize_trait(trait))
+                traits_to_upload.append(trait)
+
+        if journal.chunk_count:
+            logging.info('Resuming upload from ' + journal_file + ', ' + str(journal.chunk_count) + ' chunks already committed, '
+                         + str(len(traits_to_upload)) + ' traits left')
+        if not traits_to_upload:
+            return journal
+
+        database_action = self.read_upload_confirmation(traits_to_upload)
+        add_action = 'add' if database_action == 'COMMIT' else ROLLBACK_ACTION
+
+        for i in tqdm(range(0, len(traits_to_upload), chunk_size), desc='Chunks'):
+            chunk = traits_to_upload[i:i + chunk_size]
+            existing_traits = self.find_existing_traits(chunk)
+            chunk_results = []
+
+            try:
+                with contextlib.closing(curation_db.get_cursor(self.connection)) as cursor:
+                    new_id = cursor.var(cx_Oracle.NUMBER)
+
+                    for trait in chunk:
+                        if normalize_trait(trait) in existing_traits:
+                            logging.info(trait + ' already exists in database, skipping...')
+                            chunk_results.append([trait, 'skip', str(existing_traits[normalize_trait(trait)])])
+                            continue
+
+                        # Insert trait and return back the "id" primary key for the new row.
+                        # A refused trait, e.g. one too long for the column, is journaled as
+                        # an error and the rest of the chunk is still committed
+                        try:
+                            cursor.execute('INSERT INTO DISEASE_TRAIT VALUES (NULL, :trait) returning id into :new_id',
+                                           {'trait': trait, 'new_id': new_id})
+                        except cx_Oracle.DatabaseError as exception:
+                            logging.error('Could not add trait: ' + "'" + trait + "' " + str(exception))
+                            chunk_results.append([trait, ERROR_ACTION, 'NA'])
+                            continue
+                        chunk_results.append([trait, add_action, str(new_id.getvalue())])
+
+                    cursor.execute(database_action)
+            except cx_Oracle.DatabaseError as exception:
+                self.connection.rollback()
+                logging.error(exception)
+                logging.error('Stopped at chunk ' + str(journal.chunk_count + 1) + ', run the upload again with --upload_journal '
+                              + journal_file + ' to resume')
+                sys.exit(1)
+
+            journal.append_chunk(chunk_results)
+
+        if database_action == 'ROLLBACK':
+            logging.info('Queries executed in testing mode. No commit action was performed.')
+
+        return journal
+
+    def create_journal_result_file(self, journal):
+        ''' Write the results of all chunks in an upload journal to file, as create_result_file() does '''
+        from trait_upload_journal import ERROR_ACTION
+
+        results = journal.results()
+        num_traits_skipped = len([result for result in results if result[1] == 'skip'])
+        num_traits_failed = len([result for result in results if result[1] == ERROR_ACTION])
+
+        timestamp = _get_timestamp()
+        upload_report_filename = 'upload_report_filename_' + str(timestamp) +'.csv'
+
+        with open(upload_report_filename, "w", newline='') as csv_file:
+            writer = csv.writer(csv_file, delimiter=',')
+            writer.writerow(['Num traits added: '+str(len(results) - num_traits_skipped - num_traits_failed),
+                             ' Num traits skipped: '+str(num_traits_skipped), ' Num traits failed: '+str(num_traits_failed)])
+            writer.writerow(['Reported Trait', 'Action', 'PK (for developers)'])
+
+            for trait, action, pk in results:
+                writer.writerow([trait, action, pk])
+
+        logging.info(upload_report_filename + ' created from ' + journal.path)
+
+
 def _get_timestamp():
     ''' Get timestamp of current date. '''
     return datetime.now().strftime('%d-%m-%Y_%H%M%S')
 
 
-if __name__ == '__main__':
-    # Parsing command line arguments:
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--action', type=str, 
-        help='Task to perform, e.g. dump, analyze, upload')
-    parser.add_argument('--curation_db', type=str, 
-        help='Name of the database for extracting study data.')
-    # parser.add_argument('--logging_level', type=str, default='logging.INFO', help='Name of the database for extracting study data.')
-    args = parser.parse_args()
+def main(action, database, match_mode='levenshtein', cache_file=None,
+         metrics_history=curation_metrics.DEFAULT_HISTORY_FILE, metrics_textfile_dir=None,
+         upload_journal=None, upload_chunk_size=100):
+    ''' Run an action (dump, analyze, dedupe, upload) against the given database '''
+    if action == 'upload' and curation_db.LOCAL_REPLICA:
+        logging.warning('Exiting... upload can only be run against the curation database, not the local replica')
+        sys.exit()
 
-    database = args.curation_db
-    action = args.action
-    # logging_level = args.logging_level
+    metrics = curation_metrics.RunMetrics('reported_traits_' + str(action))
 
+    # Metrics are written for failed runs too, so that failures can be alerted on
+    with metrics.record(metrics_history, metrics_textfile_dir):
+        run_action(action, database, metrics, match_mode, cache_file, upload_journal, upload_chunk_size)
+
+
+def run_action(action, database, metrics, match_mode='levenshtein', cache_file=None, upload_journal=None,
+               upload_chunk_size=100):
+    ''' Run an action, recording its phases and rows in metrics '''
     # Open connection:
-    db_object = DBConnection.gwasCatalogDbConnector(database)
-    connection = db_object.connection
+    with metrics.phase('connect'):
+        db_pool = curation_db.get_pool(database)
+        connection = db_pool.acquire()
+
+    # Instantiate object
+    all_reported_traits_obj = ReportedTraitData(connection, database)
+
+    # Get all reported traits, a journaled upload only looks up the traits it adds
+    if not (action == 'upload' and upload_journal):
+        with metrics.phase('main_query'):
+            all_reported_traits_obj.get_all_reported_traits()
 
     ######################################
     # Create file of all Reported traits
     ######################################
     if action == 'dump':
-        # Instantiate object
-        all_reported_traits_obj = ReportedTraitData(connection, database)
-
-        # Get all reported traits
-        all_reported_traits_obj.get_all_reported_traits()
-
         # Write to file
-        all_reported_traits_obj.save_all_reported_traits_file()
+        with metrics.phase('write'):
+            all_reported_traits_obj.save_all_reported_traits_file()
+
+        metrics.rows = len(all_reported_traits_obj.corpus)
 
     ###################################
     # Analyze list of reported traits
     ###################################
     if action == 'analyze':
-        # Instantiate object
-        all_reported_traits_obj = ReportedTraitData(connection, database)
-
-        # Get all reported traits
-        all_reported_traits_obj.get_all_reported_traits()
-
         # Read file of traits
         traits_to_analyze = all_reported_traits_obj.read_reported_trait_file(action)
+        match_threshold_value = all_reported_traits_obj.read_match_threshold()
 
         # Analyze traits to find simiar reported trait 
-        similarity_results = all_reported_traits_obj.find_similar_reported_traits(traits_to_analyze)
+        with metrics.phase('analyze'):
+            similarity_results = all_reported_traits_obj.find_similar_reported_traits(
+                traits_to_analyze, match_mode, cache_file, match_threshold_value)
         
-        all_reported_traits_obj.save_all_similarities_file(similarity_results)
+        with metrics.phase('write'):
+            all_reported_traits_obj.save_all_similarities_file(similarity_results)
+
+        metrics.rows = len(traits_to_analyze)
+
+    ###################################################
+    # Find near duplicate Reported traits in database
+    ###################################################
+    if action == 'dedupe':
+        match_threshold_value = all_reported_traits_obj.read_match_threshold()
+
+        # Cluster near duplicate traits
+        with metrics.phase('dedupe'):
+            duplicate_clusters = all_reported_traits_obj.find_duplicate_reported_traits(match_threshold_value)
+
+        with metrics.phase('write'):
+            all_reported_traits_obj.save_duplicate_clusters_file(duplicate_clusters)
+
+        metrics.rows = len(all_reported_traits_obj.corpus)
 
     #######################################
     # Add Reported traits to the database
     #######################################
-    if action == 'upload':
-        # Instantiate object
-        all_reported_traits_obj = ReportedTraitData(connection, database)
-        
-        # Get all reported traits
-        all_reported_traits_obj.get_all_reported_traits()
+    if action == 'upload' and upload_journal:
+        # Read file of traits to add
+        traits_to_add_to_database = all_reported_traits_obj.read_reported_trait_file(action)
+
+        # Insert and journal the traits chunk by chunk, resuming from the journal if it exists
+        with metrics.phase('insert'):
+            journal = all_reported_traits_obj.insert_traits_in_chunks(
+                traits_to_add_to_database, upload_journal, upload_chunk_size)
+
+        # Write out results of all chunks in the journal
+        with metrics.phase('write'):
+            all_reported_traits_obj.create_journal_result_file(journal)
+
+        metrics.rows = len(traits_to_add_to_database)
 
+    elif action == 'upload':
         # Read file of traits to add
         traits_to_add_to_database = all_reported_traits_obj.read_reported_trait_file(action)
 
-        # Insert traits into the database
-        all_reported_traits_obj.insert_traits(traits_to_add_to_database)
+        # Insert traits into the database, includes waiting for the confirmation
+        with metrics.phase('insert'):
+            all_reported_traits_obj.insert_traits(traits_to_add_to_database)
 
         # Write out results of adding traits to database
-        all_reported_traits_obj.create_result_file(traits_to_add_to_database)
+        with metrics.phase('write'):
+            all_reported_traits_obj.create_result_file(traits_to_add_to_database)
+
+        metrics.rows = len(traits_to_add_to_database)
+
+    db_pool.release(connection)
+
+
+if __name__ == '__main__':
+    # Parsing command line arguments:
+    parser = argparse.ArgumentParser()
+    curation_arguments.add_traits_arguments(parser)
+    # parser.add_argument('--logging_level', type=str, default='logging.INFO', help='Name of the database for extracting study data.')
+    args = parser.parse_args()
+
+    database = args.curation_db
+    action = args.action
+    # logging_level = args.logging_level
 
+    curation_arguments.use_source(args)
 
+    main(action, database, args.match_mode, args.analysis_cache, args.metrics_history, args.metrics_textfile_dir,
+         args.upload_journal, args.upload_chunk_size)
@@ -0,0 +1,73 @@
+import contextlib
+
+from trait_analysis_cache import TraitAnalysisCache
+from trait_corpus import ReportedTraitCorpus, normalize_trait
+
+
+TRAITS = [(1, 'HDL cholesterol levels'), (2, 'Body mass index'), (3, 'LDL cholesterol levels')]
+
+
+def get_matches(cache_file, traits, incremental=True):
+    ''' Matches of "cholesterol" and the start positions the corpus was searched from '''
+    corpus = ReportedTraitCorpus(traits)
+    search_starts = []
+
+    def search(user_trait, start):
+        search_starts.append(start)
+        return [(corpus.ids[position], corpus.trait(position), 1.0) for position in range(start, len(corpus))
+                if normalize_trait(user_trait) in corpus.normalized_trait(position)]
+
+    with contextlib.closing(TraitAnalysisCache(corpus, str(cache_file))) as analysis_cache:
+        matches = analysis_cache.get_matches('Cholesterol ', 'levenshtein', 0.8, search, incremental)
+    return matches, search_starts
+
+
+def test_unchanged_corpus_is_not_searched_again(tmp_path):
+    cache_file = tmp_path / 'cache.sqlite'
+    first_matches, _ = get_matches(cache_file, TRAITS)
+
+    matches, search_starts = get_matches(cache_file, TRAITS)
+
+    assert matches == first_matches == [(1, 'HDL cholesterol levels', 1.0), (3, 'LDL cholesterol levels', 1.0)]
+    assert search_starts == []
+
+
+def test_added_traits_are_searched_alone(tmp_path):
+    cache_file = tmp_path / 'cache.sqlite'
+    get_matches(cache_file, TRAITS)
+
+    matches, search_starts = get_matches(cache_file, TRAITS + [(4, 'Asthma'), (5, 'Total cholesterol')])
+
+    assert search_starts == [3]
+    assert sorted(matches) == [(1, 'HDL cholesterol levels', 1.0), (3, 'LDL cholesterol levels', 1.0),
+                               (5, 'Total cholesterol', 1.0)]
+
+
+def test_edited_trait_searches_all_traits(tmp_path):
+    cache_file = tmp_path / 'cache.sqlite'
+    get_matches(cache_file, TRAITS)
+
+    matches, search_starts = get_matches(cache_file, [(1, 'HDL levels'), (2, 'Body mass index'),
+                                                      (3, 'LDL cholesterol levels'), (4, 'Total cholesterol')])
+
+    assert search_starts == [0]
+    assert matches == [(3, 'LDL cholesterol levels', 1.0), (4, 'Total cholesterol', 1.0)]
+
+
+def test_deleted_trait_searches_all_traits(tmp_path):
+    cache_file = tmp_path / 'cache.sqlite'
+    get_matches(cache_file, TRAITS)
+
+    matches, search_starts = get_matches(cache_file, TRAITS[1:] + [(4, 'Total cholesterol')])
+
+    assert search_starts == [0]
+    assert matches == [(3, 'LDL cholesterol levels', 1.0), (4, 'Total cholesterol', 1.0)]
+
+
+def test_added_traits_search_all_traits_when_not_incremental(tmp_path):
+    cache_file = tmp_path / 'cache.sqlite'
+    get_matches(cache_file, TRAITS, incremental=False)
+
+    _, search_starts = get_matches(cache_file, TRAITS + [(4, 'Total cholesterol')], incremental=False)
+
+    assert search_starts == [0]
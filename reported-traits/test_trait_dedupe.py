@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from trait_corpus import ReportedTraitCorpus
+from trait_dedupe import MIN_ROWS, MinHasher, candidate_pairs, find_duplicate_clusters, lsh_bands, shingles
+
+
+def zipf_traits(count, seed=7):
+    ''' Traits of words drawn with Zipf frequencies, so that a few words (like "levels") are in many traits '''
+    generator = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = [''.join(generator.choice(letters) for _ in range(generator.randint(3, 10))) for _ in range(3000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    return [' '.join(generator.choices(vocabulary, weights, k=generator.randint(2, 5))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('match_threshold_value', [0.8, 0.85, 0.9, 0.95])
+def test_lsh_bands_use_several_rows(match_threshold_value):
+    assert 128 // lsh_bands(match_threshold_value, 128) >= MIN_ROWS
+
+
+def test_candidate_pairs_are_a_small_fraction_of_all_pairs():
+    traits = zipf_traits(2000)
+    # Copies with one character changed, which must still become candidates
+    duplicates = [(position, traits[position][:-1] + 'x') for position in range(0, 2000, 100)]
+    traits += [trait for _, trait in duplicates]
+
+    min_hasher = MinHasher(128)
+    signatures = {position: min_hasher.signature(shingles(trait)) for position, trait in enumerate(traits)}
+    pairs = set(candidate_pairs(signatures, lsh_bands(0.8, 128)))
+
+    all_pairs = len(traits) * (len(traits) - 1) // 2
+    assert len(pairs) < 0.1 * all_pairs
+    for number, (position, _) in enumerate(duplicates):
+        assert (position, 2000 + number) in pairs
+
+
+def test_candidate_pairs_of_empty_corpus():
+    assert list(candidate_pairs({})) == []
+
+
+def test_find_duplicate_clusters():
+    pytest.importorskip('Levenshtein')
+
+    traits = [(1, 'HDL cholesterol levels'), (2, 'Body mass index'), (3, 'HDL cholesterol level'),
+              (4, 'Type 2 diabetes'), (5, 'body mass index '), (6, 'Asthma')]
+
+    assert find_duplicate_clusters(ReportedTraitCorpus(traits), 0.9) == [[(1, 'HDL cholesterol levels'), (3, 'HDL cholesterol level')],
+                                                    [(2, 'Body mass index'), (5, 'body mass index ')]]
+
+
+def test_find_duplicate_clusters_scores_normalized_traits():
+    pytest.importorskip('Levenshtein')
+
+    # Scored as analyze does, 'drug' against 'drugs2' is exactly 0.8
+    assert find_duplicate_clusters(ReportedTraitCorpus([(1, 'drug   '), (2, 'Drugs2')]), 0.8) == [[(1, 'drug   '), (2, 'Drugs2')]]
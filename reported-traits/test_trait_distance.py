@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+Levenshtein = pytest.importorskip('Levenshtein')
+
+from trait_distance import BoundedRatioScorer, get_ratio_function
+
+
+WORDS = ['drug', 'drugs', 'levels', 'HDL', 'cholesterol', 'body', 'mass', 'index', 'type', '2', 'diabetes',
+         'response', 'to', 'in', 'of', 'blood', 'pressure', 'asthma', 'height', 'age', 'at', 'onset']
+
+THRESHOLDS = [0.3, 0.5, 0.8, 0.85, 0.9, 0.95, 1.0]
+
+
+def random_traits(count, seed=1):
+    generator = random.Random(seed)
+    traits = []
+    for _ in range(count):
+        trait = ' '.join(generator.choice(WORDS) for _ in range(generator.randint(1, 5)))
+        # Small edits, so that many pairs score close to the thresholds
+        for _ in range(generator.randint(0, 2)):
+            position = generator.randint(0, len(trait))
+            trait = trait[:position] + generator.choice('abcdes2 ') + trait[position + 1:]
+        traits.append(trait.lower())
+    return traits
+
+
+def brute_force_matches(query, traits, match_threshold_value, start=0):
+    matches = []
+    for position in range(start, len(traits)):
+        similarity_score = Levenshtein.ratio(query, traits[position])
+        if similarity_score >= match_threshold_value:
+            matches.append((position, similarity_score))
+    return matches
+
+
+def test_ratio_function_keeps_score_at_threshold():
+    ratio = get_ratio_function()
+    assert Levenshtein.ratio('drug', 'drugs2') == 0.8
+    assert ratio('drug', 'drugs2', 0.8) == 0.8
+
+
+@pytest.mark.parametrize('match_threshold_value', THRESHOLDS)
+def test_bounded_scorer_matches_brute_force(match_threshold_value):
+    traits = random_traits(1000) + ['drugs2']
+    queries = random_traits(40, seed=2) + ['drug']
+    scorer = BoundedRatioScorer(traits, match_threshold_value)
+
+    for query in queries:
+        for start in [0, len(traits) // 2]:
+            assert scorer.matches(query, start) == brute_force_matches(query, traits, match_threshold_value, start)
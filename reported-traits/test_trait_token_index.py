@@ -0,0 +1,12 @@
+from trait_corpus import ReportedTraitCorpus
+from trait_token_index import TraitTokenIndex
+
+
+def test_search_ignores_word_order_and_reads_traits_from_corpus():
+    corpus = ReportedTraitCorpus([(1, 'HDL cholesterol levels'), (2, 'Body mass index'),
+                                  (3, 'LDL cholesterol levels'), (4, ' Levels of HDL cholesterol')])
+    token_index = TraitTokenIndex(corpus)
+
+    matches = token_index.search('hdl cholesterol levels', 0.9)
+
+    assert sorted(matches) == [(1, 'HDL cholesterol levels', 1.0), (4, ' Levels of HDL cholesterol', 1.0)]
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from trait_upload_journal import ERROR_ACTION, ROLLBACK_ACTION, UploadJournal
+
+
+class FakeDatabase:
+    ''' DISEASE_TRAIT table with the INSERT, COMMIT and ROLLBACK statements the upload runs '''
+
+    def __init__(self, traits, refused_traits=()):
+        self.traits = dict(traits)
+        self.pending_traits = {}
+        self.refused_traits = set(refused_traits)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.pending_traits.clear()
+
+
+class FakeVariable:
+
+    def getvalue(self):
+        return self.value
+
+
+class FakeCursor:
+
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+
+    def var(self, variable_type):
+        return FakeVariable()
+
+    def execute(self, sql, parameters=None):
+        import cx_Oracle
+
+        all_traits = dict(self.database.traits)
+        all_traits.update(self.database.pending_traits)
+        if sql.startswith('SELECT'):
+            self.rows = [(trait_id, trait) for trait_id, trait in all_traits.items()
+                         if trait.strip().lower() in parameters]
+        elif sql.startswith('INSERT'):
+            if parameters['trait'] in self.database.refused_traits:
+                raise cx_Oracle.DatabaseError('ORA-12899: value too large for column')
+            trait_id = max(all_traits, default=0) + 1
+            self.database.pending_traits[trait_id] = parameters['trait']
+            parameters['new_id'].value = trait_id
+        elif sql == 'COMMIT':
+            self.database.traits.update(self.database.pending_traits)
+            self.database.pending_traits.clear()
+        elif sql == 'ROLLBACK':
+            self.database.pending_traits.clear()
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+def upload(database, traits, journal_file, chunk_size=2):
+    analyze_reported_traits = pytest.importorskip('analyze_reported_traits')
+
+    reported_trait_data = analyze_reported_traits.ReportedTraitData(database, 'SPOTPRO')
+    reported_trait_data.read_upload_confirmation = lambda traits: 'COMMIT'
+    return reported_trait_data.insert_traits_in_chunks(traits, str(journal_file), chunk_size)
+
+
+def test_completed_traits_leave_out_rolled_back_and_refused_traits(tmp_path):
+    journal = UploadJournal(str(tmp_path / 'journal.jsonl'))
+    journal.append_chunk([['Height', 'add', '1'], ['BMI', 'skip', '2'], ['Asthma', ROLLBACK_ACTION, '3'],
+                          ['T2D', ERROR_ACTION, 'NA']])
+
+    assert journal.completed_traits() == set(['height', 'bmi'])
+
+
+def test_results_keep_the_latest_result_of_a_retried_trait(tmp_path):
+    journal = UploadJournal(str(tmp_path / 'journal.jsonl'))
+    journal.append_chunk([['Height', 'add', '1'], ['T2D', ERROR_ACTION, 'NA']])
+    journal.append_chunk([['t2d ', 'add', '2']])
+
+    assert UploadJournal(journal.path).results() == [('Height', 'add', '1'), ('t2d ', 'add', '2')]
+
+
+def test_truncated_last_line_is_ignored_and_ended(tmp_path):
+    journal_file = tmp_path / 'journal.jsonl'
+    UploadJournal(str(journal_file)).append_chunk([['Height', 'add', '1']])
+    with open(str(journal_file), 'a') as journal:
+        journal.write('{"chunk": 2, "results": [["BMI", "ad')
+
+    journal = UploadJournal(str(journal_file))
+    assert journal.chunk_count == 1
+    assert journal.completed_traits() == set(['height'])
+
+    journal.append_chunk([['BMI', 'add', '2']])
+    lines = journal_file.read_text().splitlines()
+    assert json.loads(lines[-1])['chunk'] == 2
+    assert UploadJournal(str(journal_file)).completed_traits() == set(['height', 'bmi'])
+
+
+def test_resumed_upload_retries_refused_traits(tmp_path):
+    journal_file = tmp_path / 'journal.jsonl'
+    database = FakeDatabase({1: 'Height'}, refused_traits=['T2D'])
+
+    upload(database, ['Height', 'BMI', 'T2D', 'Asthma'], journal_file)
+    assert sorted(database.traits.values()) == ['Asthma', 'BMI', 'Height']
+
+    database.refused_traits.clear()
+    journal = upload(database, ['Height', 'BMI', 'T2D', 'Asthma'], journal_file)
+
+    assert sorted(database.traits.values()) == ['Asthma', 'BMI', 'Height', 'T2D']
+    assert [(trait, action) for trait, action, pk in journal.results()] == [
+        ('Height', 'skip'), ('BMI', 'add'), ('Asthma', 'add'), ('T2D', 'add')]
+
+
+def test_chunk_committed_but_not_journaled_is_not_added_twice(tmp_path):
+    journal_file = tmp_path / 'journal.jsonl'
+    # The first chunk was committed, the run stopped before it was journaled
+    database = FakeDatabase({1: 'Height', 2: 'BMI'})
+
+    journal = upload(database, ['Height', 'BMI', 'T2D', 'Asthma'], journal_file)
+
+    assert sorted(database.traits.values()) == ['Asthma', 'BMI', 'Height', 'T2D']
+    assert journal.results() == [('Height', 'skip', '1'), ('BMI', 'skip', '2'), ('T2D', 'add', '3'),
+                                 ('Asthma', 'add', '4')]
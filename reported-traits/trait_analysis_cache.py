@@ -0,0 +1,144 @@
+import bisect
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import time
+
+from trait_corpus import normalize_trait
+
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.gwas_curation', 'analysis_cache.sqlite')
+
+# Upper bound of the cached match lists, least recently used entries go first
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+# Part of every cache key. Bump it whenever scoring or trait normalization
+# changes, so that entries computed the old way are no longer returned.
+# 2: matches exactly at the threshold kept with score_cutoff
+SCORER_VERSION = 2
+
+
+class TraitAnalysisCache:
+    ''' Persistent cache of analyze results, one entry per query trait
+
+    Entries are keyed by the scorer version, normalized query trait, match
+    mode and threshold, and record the version of the reported trait corpus they were computed
+    against: its highest trait id, trait count and a hash of all its traits.
+
+    When traits have only been added since an entry was stored, the entry is
+    brought up to date by scoring the query against the new traits alone.
+    Any other change to the corpus (an edited or deleted trait) makes the
+    entry a miss.
+
+    Args:
+        corpus: the current ReportedTraitCorpus
+        path: sqlite file the cache is kept in
+        max_bytes: size limit of the cached match lists
+    '''
+
+    def __init__(self, corpus, path=DEFAULT_CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.corpus = corpus
+
+        # Hashes of id-ordered prefixes of the corpus by trait count, so an
+        # entry computed against an older, smaller corpus can be recognised
+        self._prefix_hashes = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS ANALYSIS_CACHE (
+                CACHE_KEY TEXT PRIMARY KEY,
+                MAX_TRAIT_ID INTEGER,
+                TRAIT_COUNT INTEGER,
+                CORPUS_HASH TEXT,
+                MATCHES TEXT,
+                SIZE INTEGER,
+                LAST_USED REAL)
+        ''')
+
+    @property
+    def corpus_version(self):
+        if not len(self.corpus):
+            return None, 0, None
+        return self.corpus.ids[-1], len(self.corpus), self.prefix_hash(len(self.corpus))
+
+    def prefix_hash(self, trait_count):
+        ''' Hash of the ids and traits of the first trait_count traits, read from the corpus buffer without decoding '''
+        if trait_count not in self._prefix_hashes:
+            corpus_hash = hashlib.blake2b(digest_size=16)
+            for position in range(trait_count):
+                encoded_trait = self.corpus.encoded_trait(position)
+                corpus_hash.update(struct.pack('<qq', self.corpus.ids[position], len(encoded_trait)))
+                corpus_hash.update(encoded_trait)
+            self._prefix_hashes[trait_count] = corpus_hash.hexdigest()
+        return self._prefix_hashes[trait_count]
+
+    def _is_prefix(self, max_trait_id, trait_count, corpus_hash):
+        ''' True if the corpus an entry was computed against is a prefix of the current one '''
+        index = bisect.bisect_left(self.corpus.ids, max_trait_id)
+        return (index < len(self.corpus.ids) and self.corpus.ids[index] == max_trait_id
+                and index + 1 == trait_count and self.prefix_hash(trait_count) == corpus_hash)
+
+    def get_matches(self, user_trait, match_mode, match_threshold_value, search, incremental=True):
+        ''' Get the matches of a trait, from the cache where possible
+
+        Args:
+            search: function (user_trait, start) returning a list of
+            (id, trait, score) matches of user_trait among the corpus traits
+            from position start onwards
+            incremental: whether scores are independent of the rest of the
+            corpus, so that only new traits need scoring after additions
+
+        Returns:
+            list of (id, trait, score) tuples
+        '''
+        cache_key = json.dumps([SCORER_VERSION, normalize_trait(user_trait), match_mode, match_threshold_value])
+        max_trait_id, trait_count, corpus_hash = self.corpus_version
+
+        row = self.connection.execute(
+            'SELECT MAX_TRAIT_ID, TRAIT_COUNT, CORPUS_HASH, MATCHES FROM ANALYSIS_CACHE WHERE CACHE_KEY = ?',
+            (cache_key,)).fetchone()
+
+        if row is not None and row[2] == corpus_hash:
+            self.connection.execute('UPDATE ANALYSIS_CACHE SET LAST_USED = ? WHERE CACHE_KEY = ?',
+                                    (time.time(), cache_key))
+            return [tuple(match) for match in json.loads(row[3])]
+
+        if row is not None and incremental and self._is_prefix(row[0], row[1], row[2]):
+            matches = [tuple(match) for match in json.loads(row[3])] + list(search(user_trait, row[1]))
+            matches.sort(key=lambda match: match[2], reverse=True)
+        else:
+            matches = list(search(user_trait, 0))
+
+        matches_json = json.dumps(matches)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO ANALYSIS_CACHE VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (cache_key, max_trait_id, trait_count, corpus_hash, matches_json, len(matches_json), time.time()))
+        return matches
+
+    def evict(self):
+        ''' Remove least recently used entries until the cache fits in max_bytes '''
+        total_size = self.connection.execute('SELECT COALESCE(SUM(SIZE), 0) FROM ANALYSIS_CACHE').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+
+        rows = self.connection.execute('SELECT CACHE_KEY, SIZE FROM ANALYSIS_CACHE ORDER BY LAST_USED')
+        evicted_keys = []
+        for cache_key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            evicted_keys.append((cache_key,))
+            total_size -= size
+
+        self.connection.executemany('DELETE FROM ANALYSIS_CACHE WHERE CACHE_KEY = ?', evicted_keys)
+
+    def close(self):
+        self.evict()
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,103 @@
+import zlib
+from array import array
+
+
+def normalize_trait(trait):
+    ''' Form of a trait used for comparisons, lowercased without surrounding whitespace '''
+    return trait.strip().lower()
+
+
+class ReportedTraitCorpus:
+    ''' Compact, read only store of all reported traits
+
+    Trait ids are kept in an int array, ordered by id. The trait text and its
+    normalized form are each kept in one utf-8 buffer, with an array of start
+    offsets, instead of a Python string per trait. An index from the crc32 of
+    each normalized trait gives constant time exact lookups.
+
+    Args:
+        rows: DISEASE_TRAIT rows, (id, trait) first in each row
+    '''
+
+    def __init__(self, rows):
+        self.ids = array('q')
+        self._trait_offsets = array('q', [0])
+        self._normalized_offsets = array('q', [0])
+        self._index = {}
+        self._normalized_traits = None
+
+        trait_buffer = bytearray()
+        normalized_buffer = bytearray()
+
+        for position, row in enumerate(sorted((row[0], ''.join(row[1])) for row in rows)):
+            trait_id, trait = row
+            normalized = normalize_trait(trait).encode('utf-8')
+
+            self.ids.append(trait_id)
+            trait_buffer += trait.encode('utf-8')
+            self._trait_offsets.append(len(trait_buffer))
+            normalized_buffer += normalized
+            self._normalized_offsets.append(len(normalized_buffer))
+
+            # Positions sharing a hash are kept as a tuple
+            key = zlib.crc32(normalized)
+            if key in self._index:
+                existing = self._index[key]
+                self._index[key] = (existing if isinstance(existing, tuple) else (existing,)) + (position,)
+            else:
+                self._index[key] = position
+
+        self._traits = bytes(trait_buffer)
+        self._normalized = bytes(normalized_buffer)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        ''' Iterate over (id, trait) tuples in id order '''
+        for position in range(len(self.ids)):
+            yield self.ids[position], self.trait(position)
+
+    def __contains__(self, trait):
+        return self.find(trait) is not None
+
+    def trait(self, position):
+        return self._traits[self._trait_offsets[position]:self._trait_offsets[position + 1]].decode('utf-8')
+
+    def normalized_trait(self, position):
+        return self._normalized[self._normalized_offsets[position]:self._normalized_offsets[position + 1]].decode('utf-8')
+
+    def encoded_trait(self, position):
+        ''' utf-8 bytes of a trait, without decoding it '''
+        return self._traits[self._trait_offsets[position]:self._trait_offsets[position + 1]]
+
+    def encoded_normalized_trait(self, position):
+        return self._normalized[self._normalized_offsets[position]:self._normalized_offsets[position + 1]]
+
+    def traits(self):
+        ''' All trait names, in id order '''
+        return [self.trait(position) for position in range(len(self.ids))]
+
+    def normalized_traits(self):
+        ''' All normalized traits, in id order
+
+        Decoded once on first use and shared by all callers, for code that
+        compares against every trait, e.g. BoundedRatioScorer. Code that only
+        reads some traits should use normalized_trait() instead.
+        '''
+        if self._normalized_traits is None:
+            self._normalized_traits = [self.normalized_trait(position) for position in range(len(self.ids))]
+        return self._normalized_traits
+
+    def find(self, trait):
+        ''' Position of a trait, compared in normalized form, or None if it does not exist '''
+        normalized = normalize_trait(trait).encode('utf-8')
+        positions = self._index.get(zlib.crc32(normalized))
+        if positions is None:
+            return None
+
+        for position in (positions if isinstance(positions, tuple) else (positions,)):
+            if self.encoded_normalized_trait(position) == normalized:
+                return position
+        return None
+
@@ -0,0 +1,96 @@
+import bisect
+import math
+from array import array
+
+
+# Levenshtein turns score_cutoff into a maximum distance with float rounding,
+# so a ratio exactly at the cutoff can come back as 0, e.g.
+# ratio('drug', 'drugs2', score_cutoff=0.8) == 0 while the ratio is 0.8.
+# The cutoff is lowered by this margin and the caller applies the threshold.
+SCORE_CUTOFF_MARGIN = 1e-5
+
+
+def get_ratio_function():
+    ''' Levenshtein.ratio taking a threshold, as ratio(a, b, threshold)
+
+    Newer Levenshtein releases accept a score_cutoff and stop computing the
+    distance as soon as the cutoff can no longer be reached. Older releases
+    always compute the full distance, the threshold is then ignored here.
+    Either way the returned score may be below the threshold, the caller
+    must still compare it with the threshold.
+    '''
+    import Levenshtein
+
+    try:
+        Levenshtein.ratio('', '', score_cutoff=0.5)
+    except TypeError:
+        return lambda first, second, threshold: Levenshtein.ratio(first, second)
+
+    return lambda first, second, threshold: Levenshtein.ratio(
+        first, second, score_cutoff=max(threshold - SCORE_CUTOFF_MARGIN, 0))
+
+
+def length_window(length, match_threshold_value):
+    ''' Range of trait lengths that can reach the threshold against a trait of the given length
+
+    Levenshtein.ratio is (len_a + len_b - distance) / (len_a + len_b) and the
+    distance is at least the difference in length, so the ratio is at most
+    2 * min(len_a, len_b) / (len_a + len_b). The window is one character wider
+    on each side so that float rounding never excludes a match.
+
+    Returns:
+        (min_length, max_length) tuple, max_length is None for no upper bound
+    '''
+    if match_threshold_value <= 0:
+        return 0, None
+
+    min_length = math.floor(length * match_threshold_value / (2 - match_threshold_value)) - 1
+    max_length = math.ceil(length * (2 - match_threshold_value) / match_threshold_value) + 1
+    return max(min_length, 0), max_length
+
+
+class BoundedRatioScorer:
+    ''' Scores a trait against a list of traits, only where the threshold can be reached
+
+    Traits are indexed by length, so only those within the length window of
+    the query are compared, and each comparison stops early once the
+    threshold is out of reach where Levenshtein supports it. Scores of the
+    matches are exactly those of Levenshtein.ratio.
+
+    Args:
+        traits: list of normalized traits, e.g. the shared
+            ReportedTraitCorpus.normalized_traits()
+        match_threshold_value: minimum ratio of a match
+    '''
+
+    def __init__(self, traits, match_threshold_value):
+        self.traits = traits
+        self.match_threshold_value = match_threshold_value
+        self.ratio = get_ratio_function()
+
+        self.lengths = array('q', (len(traits[position]) for position in range(len(traits))))
+        self.positions_by_length = array('q', sorted(range(len(traits)), key=self.lengths.__getitem__))
+        self.sorted_lengths = array('q', (self.lengths[position] for position in self.positions_by_length))
+
+    def matches(self, query, start=0):
+        ''' Positions and scores of the traits from position start onwards that reach the threshold
+
+        Returns:
+            list of (position, score) tuples in position order
+        '''
+        min_length, max_length = length_window(len(query), self.match_threshold_value)
+
+        if start:
+            positions = [position for position in range(start, len(self.traits))
+                         if min_length <= self.lengths[position] and (max_length is None or self.lengths[position] <= max_length)]
+        else:
+            low = bisect.bisect_left(self.sorted_lengths, min_length)
+            high = len(self.sorted_lengths) if max_length is None else bisect.bisect_right(self.sorted_lengths, max_length)
+            positions = sorted(self.positions_by_length[low:high])
+
+        matches = []
+        for position in positions:
+            similarity_score = self.ratio(query, self.traits[position], self.match_threshold_value)
+            if similarity_score >= self.match_threshold_value:
+                matches.append((position, similarity_score))
+        return matches
@@ -0,0 +1,92 @@
+import math
+import re
+from array import array
+from collections import defaultdict
+
+
+# Words that say nothing about the trait itself, ignored for matching
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'into', 'of',
+    'on', 'or', 'the', 'to', 'vs', 'with', 'without'
+    ])
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(trait):
+    ''' Split a trait into its set of lowercase word tokens, without stop words '''
+    return frozenset(token for token in TOKEN_PATTERN.findall(trait.lower()) if token not in STOP_WORDS)
+
+
+class TraitTokenIndex:
+    ''' Inverted index from word tokens to reported trait positions
+
+    Traits are scored against a query with an IDF weighted Jaccard similarity
+    of their token sets, so word order does not matter, e.g.
+    "HDL cholesterol levels" and "levels of HDL cholesterol" score 1.0.
+    Only traits sharing an informative token with the query are scored, their
+    tokens are read from the corpus when they are scored.
+
+    Args:
+        corpus: ReportedTraitCorpus of the reported traits
+        max_document_fraction: tokens found in more than this fraction of all
+            traits (e.g. "levels") are not used to look up candidates
+    '''
+
+    def __init__(self, corpus, max_document_fraction=0.05):
+        self.corpus = corpus
+        self.postings = defaultdict(lambda: array('q'))
+
+        for position in range(len(corpus)):
+            for token in tokenize(corpus.normalized_trait(position)):
+                self.postings[token].append(position)
+
+        num_traits = len(corpus)
+        self.idf = {token: math.log((1 + num_traits) / (1 + len(positions))) + 1
+                    for token, positions in self.postings.items()}
+
+        # Weight of a token that is not in the index at all
+        self.unseen_idf = math.log(1 + num_traits) + 1
+
+        self.max_postings = max(1, int(max_document_fraction * num_traits))
+
+    def weight(self, tokens):
+        return sum(self.idf.get(token, self.unseen_idf) for token in tokens)
+
+    def score(self, query_tokens, trait_tokens):
+        ''' IDF weighted Jaccard similarity of two token sets, between 0 and 1 '''
+        union_weight = self.weight(query_tokens | trait_tokens)
+        if not union_weight:
+            return 0.0
+        return self.weight(query_tokens & trait_tokens) / union_weight
+
+    def candidates(self, query_tokens):
+        ''' Corpus positions of all traits sharing an informative token with the query '''
+        indexed_tokens = [token for token in query_tokens if token in self.postings]
+        informative_tokens = [token for token in indexed_tokens if len(self.postings[token]) <= self.max_postings]
+
+        # A query made only of common tokens still has to find something
+        lookup_tokens = informative_tokens or indexed_tokens
+
+        candidate_positions = set()
+        for token in lookup_tokens:
+            candidate_positions.update(self.postings[token])
+        return candidate_positions
+
+    def search(self, trait, threshold):
+        ''' Find indexed traits similar to a trait
+
+        Returns:
+            list of (id, trait, score) tuples with score >= threshold,
+            highest score first
+        '''
+        query_tokens = tokenize(trait)
+
+        matches = []
+        for position in self.candidates(query_tokens):
+            similarity_score = self.score(query_tokens, tokenize(self.corpus.normalized_trait(position)))
+            if similarity_score >= threshold:
+                matches.append((self.corpus.ids[position], self.corpus.trait(position), similarity_score))
+
+        matches.sort(key=lambda match: match[2], reverse=True)
+        return matches
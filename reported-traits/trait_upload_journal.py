@@ -0,0 +1,76 @@
+import json
+import os
+
+from trait_corpus import normalize_trait
+
+
+# Action of traits inserted in testing mode, they were rolled back and are uploaded again on resume
+ROLLBACK_ACTION = 'rollback'
+
+# Action of traits the database refused, they are tried again on resume
+ERROR_ACTION = 'error'
+
+RETRIED_ACTIONS = (ROLLBACK_ACTION, ERROR_ACTION)
+
+
+class UploadJournal:
+    ''' Append only journal of a chunked trait upload
+
+    Each committed chunk is appended as one JSON line holding the
+    [trait, action, pk] result of every trait in it, and flushed to disk
+    before the next chunk starts. A line cut short by a crash is ignored
+    when the journal is read back, its chunk is then uploaded again.
+
+    Args:
+        path: journal file, created if it does not exist
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.chunk_count = 0
+        self._results = []
+        # A cut short last line must be ended before the next chunk is appended
+        self._ends_in_partial_line = False
+
+        if os.path.exists(path):
+            with open(path) as journal_file:
+                for line in journal_file:
+                    self._ends_in_partial_line = not line.endswith('\n')
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.chunk_count += 1
+                    self._results.extend(tuple(result) for result in chunk['results'])
+
+    def results(self):
+        ''' (trait, action, pk) results of all journaled chunks, in upload order
+
+        A trait rolled back in testing mode or refused by the database, and
+        uploaded again later, only keeps its latest result.
+        '''
+        latest_results = {}
+        for result in self._results:
+            latest_results.pop(normalize_trait(result[0]), None)
+            latest_results[normalize_trait(result[0])] = result
+        return list(latest_results.values())
+
+    def completed_traits(self):
+        ''' Normalized traits already added or skipped, which a resumed upload leaves out '''
+        return set(normalize_trait(trait) for trait, action, pk in self._results if action not in RETRIED_ACTIONS)
+
+    def append_chunk(self, results):
+        ''' Durably record the results of a committed chunk '''
+        line = json.dumps({'chunk': self.chunk_count + 1, 'results': [list(result) for result in results]})
+
+        if self._ends_in_partial_line:
+            line = '\n' + line
+            self._ends_in_partial_line = False
+
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(line + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        self.chunk_count += 1
+        self._results.extend(tuple(result) for result in results)
@@ -1,6 +1,6 @@
 # Activate Python venv for the script - uncomment to run script on commandline
-activate_this_file = "/path/to/bin/activate_this.py"
-execfile(activate_this_file, dict(__file__ = activate_this_file))
+# activate_this_file = "/path/to/bin/activate_this.py"
+# exec(open(activate_this_file).read(), dict(__file__ = activate_this_file))
 
 import cx_Oracle
 import contextlib
@@ -9,16 +9,23 @@ import sys
 from tqdm import tqdm
 import csv
 import os.path
+from multiprocessing import Pool
 
-sys.path.insert(0, '/path/to/gwas_data_sources')
-import gwas_data_sources
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import curation_arguments
+import curation_db
 
 import datetime
 
 
-def get_curation_review_data(pmid, ancestry_mode, curator):
+def get_curation_review_data(pmid, ancestry_mode, curator, connection=None):
     '''
     Get data for Level 2 review.
+
+    If no connection is given, one is opened for this call and closed
+    afterwards. With ancestry_mode 'both' the study data is extracted once
+    and written to a collapsed and an expanded file. Returns the names of
+    the review files created.
     '''
 
     # List of queries
@@ -118,18 +125,18 @@ def get_curation_review_data(pmid, ancestry_mode, curator):
     all_level2_data = []
 
 
-    if ancestry_mode == 'collapsed':
-        level2_attr_list = ['STUDY_ID', 'DUP_TAG', 'REPORTED_TRAIT', 'STUDY_CREATION_DATE', 'CURATION_STATUS', 'STUDY_ACCCESSION',\
+    level2_attr_lists = {}
+    level2_attr_lists['collapsed'] = ['STUDY_ID', 'DUP_TAG', 'REPORTED_TRAIT', 'STUDY_CREATION_DATE', 'CURATION_STATUS', 'STUDY_ACCCESSION',\
         'CATALOG_PUBLISH_DATE', 'PUBMED_ID', 'FIRST_AUTHOR', 'PUBLICATION_DATE', 'JOURNAL', 'LINK', 'TITLE', 'PLATFORM [SNPS PASSING QC]',\
         'ASSOCIATION_COUNT', 'MAPPED_TRAIT', 'MAPPED_TRAIT_URI', 'GENOTYPING_TECHNOLOGY', 'INITIAL_SAMPLE_DESCRIPTION', \
         'REPLICATION_SAMPLE_DESCRIPTION']
-    else:
-        level2_attr_list = ['STUDY_ID', 'DUP_TAG', 'REPORTED_TRAIT', 'STUDY_CREATION_DATE', 'CURATION_STATUS', 'STUDY_ACCCESSION',\
+    level2_attr_lists['expanded'] = ['STUDY_ID', 'DUP_TAG', 'REPORTED_TRAIT', 'STUDY_CREATION_DATE', 'CURATION_STATUS', 'STUDY_ACCCESSION',\
         'CATALOG_PUBLISH_DATE', 'PUBMED_ID', 'FIRST_AUTHOR', 'PUBLICATION_DATE', 'JOURNAL', 'LINK', 'TITLE', 'PLATFORM [SNPS PASSING QC]',\
         'ASSOCIATION_COUNT', 'MAPPED_TRAIT', 'MAPPED_TRAIT_URI', 'GENOTYPING_TECHNOLOGY', 'INITIAL_SAMPLE_DESCRIPTION', \
         'REPLICATION_SAMPLE_DESCRIPTION', 'STAGE', 'NUMBER_OF_INDIVIDUALS', 'BROAD_ANCESTRAL_CATEGORY', 'COUNTRY_OF_ORIGIN',\
         'COUNTRY_OF_RECRUITMENT', 'ADDITONAL_ANCESTRY_DESCRIPTION']
 
+    output_modes = ['collapsed', 'expanded'] if ancestry_mode == 'both' else [ancestry_mode]
 
 
     # Get First Author name to include in output filename
@@ -140,39 +147,32 @@ def get_curation_review_data(pmid, ancestry_mode, curator):
             and P.PUBMED_ID= :pmid
     """
 
-    first_author = ""
-    try:
-        ip, port, sid, username, password = gwas_data_sources.get_db_properties(DATABASE_NAME)
-        dsn_tns = cx_Oracle.makedsn(ip, port, sid)
-        connection = cx_Oracle.connect(username, password, dsn_tns)
+    is_own_connection = connection is None
+    if is_own_connection:
+        db_pool = curation_db.get_pool(DATABASE_NAME)
+        connection = db_pool.acquire()
 
-        with contextlib.closing(connection.cursor()) as cursor:
+    try:
+        with contextlib.closing(curation_db.get_cursor(connection)) as cursor:
             cursor.prepare(first_author_sql)
             cursor.execute(None, {'pmid': pmid})
             first_author_data = cursor.fetchone()
             first_author = first_author_data[0]
 
-        connection.close()
-
-    except cx_Oracle.DatabaseError, exception:
-        print exception
-
-    
-    TIMESTAMP = get_timestamp()
-
-    outfile = open(first_author+"_"+pmid+"-"+ancestry_mode+"_"+curator+"_"+TIMESTAMP+".csv", "w")
-    csvout = csv.writer(outfile)
-    csvout.writerow(level2_attr_list)
-
+        TIMESTAMP = get_timestamp()
 
-    # Get data for curation review file
-    try:
-        ip, port, sid, username, password = gwas_data_sources.get_db_properties(DATABASE_NAME)
-        dsn_tns = cx_Oracle.makedsn(ip, port, sid)
-        connection = cx_Oracle.connect(username, password, dsn_tns)
+        outfile_names = []
+        csvouts = {}
+        with contextlib.ExitStack() as outfiles, contextlib.closing(curation_db.get_cursor(connection)) as cursor:
+            for output_mode in output_modes:
+                outfile_name = first_author+"_"+pmid+"-"+output_mode+"_"+curator+"_"+TIMESTAMP+".csv"
+                outfile = outfiles.enter_context(open(outfile_name, "w"))
+                outfile_names.append(outfile_name)
 
+                csvouts[output_mode] = csv.writer(outfile)
+                csvouts[output_mode].writerow(level2_attr_lists[output_mode])
 
-        with contextlib.closing(connection.cursor()) as cursor:
+            # Get data for curation review file
             cursor.prepare(curation_level2_data_sql)
             cursor.execute(None, {'pmid': pmid})
             curation_queue_data = cursor.fetchall()
@@ -306,10 +306,20 @@ def get_curation_review_data(pmid, ancestry_mode, curator):
                 data_results['ASSOCIATION_COUNT'] = association_cnt[0]
 
 
+                #######################
+                # Collapsed Ancestry
+                #######################
+                if 'collapsed' in csvouts:
+                    # Write out results
+                    data_keys = data_results.keys()
+                    results = [(data_results[key]) for key in level2_attr_lists['collapsed'] if key in data_keys]
+                    csvouts['collapsed'].writerow(results)
+
+
                 #######################
                 # Expanded Ancestry
                 #######################
-                if ancestry_mode == 'expanded':
+                if 'expanded' in csvouts:
 
                     # General Ancestry information
                     cursor.prepare(expanded_ancestry_sql)           
@@ -350,22 +360,85 @@ def get_curation_review_data(pmid, ancestry_mode, curator):
 
                         # Write out results
                         data_keys = data_results.keys()
-                        results = [(data_results[key]) for key in level2_attr_list if key in data_keys]
-                        csvout.writerow(results)
+                        results = [(data_results[key]) for key in level2_attr_lists['expanded'] if key in data_keys]
+                        csvouts['expanded'].writerow(results)
 
 
-                else:
-                    # Write out results
-                    data_keys = data_results.keys()
-                    results = [(data_results[key]) for key in level2_attr_list if key in data_keys]
-                    csvout.writerow(results)
+    finally:
+        if is_own_connection:
+            db_pool.release(connection)
+
+    return outfile_names
+
+
+def _init_queue_worker(database_name, local_replica):
+    '''
+    Set up a queue mode worker process. Connections are taken from the
+    worker's pool for each PMID, a failing initializer would make the Pool
+    restart workers forever.
+    '''
+    global DATABASE_NAME
+    DATABASE_NAME = database_name
+    if local_replica:
+        curation_db.use_local_replica(local_replica)
+
+
+def _create_queue_review_file(review_args):
+    '''
+    Create the review file for one PMID in a worker process. Errors, including
+    failing to connect, are returned rather than raised so that one failing
+    PMID does not stop the run.
+
+    The connection is acquired from the pool for this PMID only, so an idle
+    session is pinged before use, and it is dropped from the pool after an
+    error, so that a lost session fails one PMID rather than all that follow.
+    '''
+    pmid, ancestry_mode, curator = review_args
+    db_pool = connection = None
+    try:
+        db_pool = curation_db.get_pool(DATABASE_NAME, pool_min=1, pool_max=1)
+        connection = db_pool.acquire()
+        outfile_names = get_curation_review_data(pmid, ancestry_mode, curator, connection=connection)
+        db_pool.release(connection)
+        return pmid, outfile_names, None
+    except Exception as exception:
+        if connection is not None:
+            try:
+                db_pool.drop(connection)
+            except Exception:
+                # Already closed or released, there is nothing left to drop
+                pass
+        return pmid, None, str(exception)
+
+
+def get_curation_queue_review_data(database_name, ancestry_mode, curator, processes):
+    '''
+    Get data for Level 2 review for every publication in the Curation Queue.
+    '''
+    # Only needed in queue mode
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'curation-queue'))
+    import curation_queue_with_ancestry
+
+    pmids = curation_queue_with_ancestry.get_curation_queue_pmids(database_name)
+
+    # Worker processes open their own pools, do not fork with this one open
+    curation_db.close_pools()
+
+    review_args = [(pmid, ancestry_mode, curator) for pmid in pmids]
+    failed_pmids = []
 
+    with Pool(processes=processes, initializer=_init_queue_worker, initargs=(database_name, curation_db.LOCAL_REPLICA)) as pool:
+        results = pool.imap_unordered(_create_queue_review_file, review_args)
 
-        connection.close()
+        for pmid, outfile_names, error in tqdm(results, total=len(review_args), desc='Create Level 2 review files'):
+            if error is not None:
+                failed_pmids.append((pmid, error))
 
+    print('Created ' + str(len(pmids) - len(failed_pmids)) + ' of ' + str(len(pmids)) + ' review files.')
+    for pmid, error in failed_pmids:
+        print('Failed PMID ' + str(pmid) + ': ' + error)
 
-    except cx_Oracle.DatabaseError, exception:
-        print exception
+    return failed_pmids
 
 
 def get_timestamp():
@@ -376,6 +449,24 @@ def get_timestamp():
     return timestamp
 
 
+def main(database_name, pmid, ancestry, username, queue=False, processes=4):
+    '''
+    Create Level2 curation check file(s).
+    '''
+    global DATABASE_NAME
+    DATABASE_NAME = database_name
+
+    if queue:
+        failed_pmids = get_curation_queue_review_data(DATABASE_NAME, ancestry, username, processes)
+        if failed_pmids:
+            sys.exit(1)
+    else:
+        try:
+            get_curation_review_data(pmid, ancestry, username)
+        except cx_Oracle.DatabaseError as exception:
+            print(exception)
+
+
 if __name__ == '__main__':
     '''
     Create Level2 curation check file.
@@ -383,22 +474,9 @@ if __name__ == '__main__':
 
     # Commandline arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('--database', default='SPOTPRO', choices=['SPOTPRO'], 
-                        help='Run as (default: SPOTPRO).')
-    parser.add_argument('--pmid', default='28256260', help='Add Pubmed Identifier, e.g. 28256260.')
-    parser.add_argument('--ancestry', default='collapsed', choices=['collapsed', 'expanded'], 
-                        help='Run as (default: collapsed).')
-    parser.add_argument('--username', default='gwas-curator', help='Run as (default: gwas-curator).')
+    curation_arguments.add_review_arguments(parser)
     args = parser.parse_args()
 
-    global DATABASE_NAME
-    DATABASE_NAME = args.database
-
-    pmid = args.pmid
-    ancestry = args.ancestry
-    username = args.username
-
-    get_curation_review_data(pmid, ancestry, username)
-    
-
+    curation_arguments.use_source(args)
 
+    main(args.database, args.pmid, args.ancestry, args.username, args.queue, args.processes)